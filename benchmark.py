@@ -0,0 +1,615 @@
+"""
+Benchmark do formatador com petições sintéticas.
+
+Gera documentos de tamanho e composição configuráveis e mede, cada etapa em
+um processo próprio, o tempo, a vazão em parágrafos por segundo e o pico de
+memória (RSS). Os resultados podem ser salvos em JSON e comparados com os de
+outro commit para detectar regressões.
+
+Exemplos:
+    python benchmark.py --paragrafos 5000 --documentos 8 --saida base.json
+    python benchmark.py --paragrafos 5000 --documentos 8 --comparar base.json
+    python benchmark.py --documentos 16 --workers 8 --verificar-threads --etapas classificacao
+    python benchmark.py --importacao --etapas classificacao
+    python benchmark.py --verificar-lote --etapas classificacao
+    python benchmark.py --verificar-classificador --etapas classificacao
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# Pesos padrão de cada tipo de parágrafo gerado
+MIX_PADRAO = {
+    'normal': 50,
+    'citacao': 8,
+    'artigo': 6,
+    'secao': 3,
+    'marcador': 4,
+    'lista': 6,
+    'doc': 4,
+    'pedidos': 1,
+    'vazio': 8,
+}
+
+FRASES = [
+    "O autor celebrou contrato de prestação de serviços com a ré em meados do ano anterior",
+    "conforme se verifica pelos documentos que acompanham a presente petição inicial",
+    "a conduta da requerida causou prejuízos de ordem material e moral ao requerente",
+    "sendo certo que a jurisprudência dos tribunais superiores é pacífica nesse sentido",
+    "não restando alternativa senão a busca pela tutela jurisdicional adequada",
+    "o que se comprova pelas mensagens trocadas entre as partes e pelos recibos anexos",
+]
+
+SECOES = ['DOS FATOS', 'DO DIREITO', 'DA RESPONSABILIDADE CIVIL', 'DOS DANOS MORAIS',
+          'DA TUTELA DE URGÊNCIA', 'DAS PROVAS', 'DA GRATUIDADE DE JUSTIÇA']
+
+ROMANOS = ['I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X']
+
+
+def _frase(rnd, minimo=1, maximo=4):
+    return ', '.join(rnd.choice(FRASES) for _ in range(rnd.randint(minimo, maximo))) + '.'
+
+
+def _textos_sinteticos(n_paragrafos, mix, rnd):
+    """Gera os textos de uma petição com aproximadamente n_paragrafos parágrafos."""
+    textos = [
+        "EXMO. SR. DR. JUIZ DE DIREITO DA 12ª VARA CÍVEL DA COMARCA DE BELO HORIZONTE/MG",
+        "",
+        "AÇÃO DE INDENIZAÇÃO POR DANOS MORAIS E MATERIAIS",
+    ]
+    tipos = list(mix)
+    pesos = [mix[t] for t in tipos]
+    secao = 0
+
+    while len(textos) < n_paragrafos:
+        tipo = rnd.choices(tipos, pesos)[0]
+        if tipo == 'normal':
+            textos.append(_frase(rnd))
+        elif tipo == 'citacao':
+            textos.append(f"“{_frase(rnd, 1, 2)}” (STJ, REsp {rnd.randint(100000, 999999)}/MG)")
+        elif tipo == 'artigo':
+            textos.append(rnd.choice([
+                f"Art. {rnd.randint(1, 999)} do Código Civil: aquele que causar dano a outrem fica obrigado a repará-lo.",
+                f"§ {rnd.randint(1, 5)}º A indenização mede-se pela extensão do dano.",
+                f"Nos termos do inciso {rnd.choice(ROMANOS)} do art. 5º da Constituição, {_frase(rnd, 1, 1)}",
+            ]))
+        elif tipo == 'secao':
+            textos.append(f"{ROMANOS[secao % len(ROMANOS)]} - {SECOES[secao % len(SECOES)]}")
+            secao += 1
+        elif tipo == 'marcador':
+            textos.append(f"• {_frase(rnd, 1, 1)}")
+        elif tipo == 'lista':
+            textos.append(f"{rnd.choice('abcde')}) {_frase(rnd, 1, 1)}")
+        elif tipo == 'doc':
+            textos.append(f"Doc. {rnd.randint(1, 40):02d} - Comprovante")
+        elif tipo == 'pedidos':
+            textos.append("DOS PEDIDOS")
+            for k in range(1, rnd.randint(3, 8)):
+                textos.append(f"{k}. Seja a ré condenada {_frase(rnd, 1, 1)}")
+            textos.append("")
+        else:
+            textos.append("")
+
+    return textos[:n_paragrafos]
+
+
+def _adicionar_runs_com_enfase(paragrafo, texto, rnd):
+    """
+    Divide o texto em runs como o Word costuma fazer: o texto corrido quebrado
+    em runs de mesma formatação e algumas palavras em negrito ou itálico (com
+    tamanho de fonte próprio, que o formatador descarta).
+    """
+    from docx.shared import Pt
+    palavras = texto.split(' ')
+    inicio = rnd.randrange(len(palavras))
+    fim = min(len(palavras), inicio + rnd.randint(1, 3))
+    antes, destaque, depois = palavras[:inicio], palavras[inicio:fim], palavras[fim:]
+    meio = len(antes) // 2
+    for parte in (antes[:meio], antes[meio:]):
+        if parte:
+            paragrafo.add_run(' '.join(parte) + ' ')
+    run = paragrafo.add_run(' '.join(destaque))
+    if rnd.random() < 0.5:
+        run.bold = True
+    else:
+        run.italic = True
+    run.font.size = Pt(13)
+    if depois:
+        paragrafo.add_run(' ' + ' '.join(depois))
+
+
+def gerar_peticao(n_paragrafos=1000, mix=None, n_tabelas=0, linhas_tabela=20, colunas_tabela=4, semente=0,
+                  enfase=0.0):
+    """
+    Gera uma petição sintética (.docx) e retorna seus bytes.
+
+    mix define o peso relativo de cada tipo de parágrafo (ver MIX_PADRAO);
+    as tabelas são distribuídas em posições aleatórias do corpo. enfase é a
+    fração dos parágrafos com trechos em negrito ou itálico, divididos em
+    vários runs.
+    """
+    from docx import Document
+    from docx.oxml import OxmlElement
+    from docx.text.paragraph import Paragraph
+
+    rnd = random.Random(semente)
+    textos = _textos_sinteticos(n_paragrafos, mix or MIX_PADRAO, rnd)
+    posicoes_tabelas = set(rnd.sample(range(len(textos)), min(n_tabelas, len(textos))))
+
+    doc = Document()
+    fim_do_corpo = doc.element.body.sectPr
+    for i, texto in enumerate(textos):
+        p = OxmlElement('w:p')
+        if texto and enfase and rnd.random() < enfase:
+            _adicionar_runs_com_enfase(Paragraph(p, None), texto, rnd)
+        elif texto:
+            Paragraph(p, None).add_run(texto)
+        fim_do_corpo.addprevious(p)
+        if i in posicoes_tabelas:
+            tabela = doc.add_table(rows=linhas_tabela, cols=colunas_tabela)
+            for linha, row in enumerate(tabela.rows):
+                for coluna, cell in enumerate(row.cells):
+                    cell.text = "Documento" if linha == 0 else f"Evidência {linha}.{coluna}"
+            # add_table insere antes do sectPr, que continua sendo o fim do corpo
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+# Etapas medidas. Cada uma recebe os documentos gerados e retorna o número de
+# parágrafos processados; rodam em um processo novo para isolar o pico de memória.
+
+def _contar_paragrafos(documentos):
+    from docx import Document
+    return sum(len(Document(io.BytesIO(dados)).paragraphs) for dados in documentos)
+
+
+def etapa_classificacao(documentos):
+    from docx import Document
+    from formatador import classificar_paragrafos_lote
+    textos = [[p.text for p in Document(io.BytesIO(dados)).paragraphs] for dados in documentos]
+
+    def executar():
+        for lista in textos:
+            classificar_paragrafos_lote(lista)
+    return executar
+
+
+def etapa_formatar_documento(documentos):
+    from formatador import MemoParagrafos, formatar_documento
+
+    def executar():
+        for dados in documentos:
+            formatar_documento(io.BytesIO(dados), None, memo=MemoParagrafos())
+    return executar
+
+
+def etapa_preservar_runs(documentos):
+    """formatar_documento mantendo a ênfase dos runs originais."""
+    from formatador import MemoParagrafos, formatar_documento
+
+    def executar():
+        for dados in documentos:
+            formatar_documento(io.BytesIO(dados), None, memo=MemoParagrafos(), preservar_runs=True)
+    return executar
+
+
+def _etapa_backend_paragrafos(documentos, backend):
+    from docx import Document
+    from formatador import BACKENDS_PARAGRAFO, ESTILOS_CONFIG, classificar_paragrafos_lote
+    criar = BACKENDS_PARAGRAFO[backend]
+    paragrafos = []
+    for dados in documentos:
+        textos = [p.text for p in Document(io.BytesIO(dados)).paragraphs]
+        paragrafos.extend((texto, ESTILOS_CONFIG.get(tipo, ESTILOS_CONFIG['normal'])['nome'])
+                          for texto, tipo in classificar_paragrafos_lote(textos) if tipo is not None)
+
+    def executar():
+        for texto, estilo in paragrafos:
+            criar(texto, estilo)
+    return executar
+
+
+def etapa_paragrafos_docx(documentos):
+    """Só a construção dos elementos w:p, com os objetos do python-docx."""
+    return _etapa_backend_paragrafos(documentos, 'python-docx')
+
+
+def etapa_paragrafos_lxml(documentos):
+    """Só a construção dos elementos w:p, diretamente com o lxml."""
+    return _etapa_backend_paragrafos(documentos, 'lxml')
+
+
+def etapa_formatar_streaming(documentos):
+    from formatador import MemoParagrafos, formatar_documento_streaming
+
+    def executar():
+        for dados in documentos:
+            formatar_documento_streaming(io.BytesIO(dados), None, memo=MemoParagrafos())
+    return executar
+
+
+def etapa_criar_zip(documentos):
+    from formatador import criar_arquivo_zip, formatar_arquivo
+    saidas = [formatar_arquivo(f"peticao_{i}.docx", dados)[:2] for i, dados in enumerate(documentos)]
+
+    def executar():
+        criar_arquivo_zip(saidas)
+    return executar
+
+
+def etapa_fluxo_completo(documentos, max_workers=1):
+    """Mesmo caminho do botão "Formatar Documentos" do app, sem a interface."""
+    from formatador import criar_arquivo_zip, formatar_lote
+    arquivos = [(f"peticao_{i}.docx", dados) for i, dados in enumerate(documentos)]
+
+    def executar():
+        resultados = [None] * len(arquivos)
+        for i, _, resultado, erro in formatar_lote(arquivos, max_workers=max_workers):
+            if erro is None:
+                resultados[i] = resultado[:2]
+        criar_arquivo_zip([r for r in resultados if r is not None])
+    return executar
+
+
+ETAPAS = {
+    'classificacao': etapa_classificacao,
+    'formatar_documento': etapa_formatar_documento,
+    'formatar_streaming': etapa_formatar_streaming,
+    'preservar_runs': etapa_preservar_runs,
+    'paragrafos_docx': etapa_paragrafos_docx,
+    'paragrafos_lxml': etapa_paragrafos_lxml,
+    'criar_arquivo_zip': etapa_criar_zip,
+    'fluxo_completo': etapa_fluxo_completo,
+}
+
+
+# Parágrafos representativos com a classificação (tipo, negrito, alinhamento) da
+# implementação original, fora e dentro da seção de pedidos
+CORPUS_CLASSIFICADOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus_classificador.json')
+
+
+def verificar_classificador(caminho=CORPUS_CLASSIFICADOR):
+    """
+    Classifica cada texto do corpus com as regras padrão, um a um, em lote e
+    pela memória de parágrafos, nos dois estados da seção de pedidos. Retorna
+    os (texto, em_pedidos, obtido, esperado) que divergiram do corpus.
+    """
+    from formatador import MemoParagrafos, detectar_tipo_paragrafo
+    from regras import REGRAS
+
+    with open(caminho, encoding='utf-8') as f:
+        corpus = json.load(f)
+    classificador = REGRAS.classificador
+    memo = MemoParagrafos()
+    divergentes = []
+    for em_pedidos, campo in ((False, 'fora_pedidos'), (True, 'em_pedidos')):
+        textos = [item['texto'] for item in corpus]
+        lote = classificador.classificar_lote(textos, [em_pedidos] * len(textos))
+        for item, em_lote in zip(corpus, lote):
+            esperado = tuple(item[campo])
+            texto = item['texto']
+            for obtido in (detectar_tipo_paragrafo(texto, em_pedidos), em_lote,
+                           memo.classificar(texto.strip(), em_pedidos)):
+                if obtido != esperado:
+                    divergentes.append((texto, em_pedidos, obtido, esperado))
+                    break
+    return divergentes
+
+
+# Conjunto de regras em que um parágrafo classificado como 'secao_pedidos' abre a
+# seção de pedidos sem casar com inicio_pedidos (usado com --verificar-lote)
+REGRAS_VERIFICACAO_LOTE = {
+    'regras': [{'tipo': 'secao_pedidos', 'negrito': True, 'alinhamento': 'left', 'prioridade': 2000,
+                'inicio': 'REQUERIMENTOS'}],
+}
+
+
+def verificar_classificacao_lote(n_paragrafos, documentos, mix=None):
+    """
+    Compara classificar_paragrafos_lote com classificar_paragrafos (tipos e
+    debug_info), com e sem memória, nas regras padrão e em
+    REGRAS_VERIFICACAO_LOTE. Retorna os (regras, índice) divergentes.
+    """
+    from formatador import MemoParagrafos, classificar_paragrafos, classificar_paragrafos_lote
+    from regras import REGRAS, ConjuntoRegras
+
+    personalizadas = ConjuntoRegras(REGRAS_VERIFICACAO_LOTE, 'verificacao-lote')
+    divergentes = []
+    for i in range(documentos):
+        textos = _textos_sinteticos(n_paragrafos, mix or MIX_PADRAO, random.Random(i))
+        casos = (('padrao', REGRAS, textos),
+                 ('secao_pedidos', personalizadas, [t.replace('DOS PEDIDOS', 'REQUERIMENTOS') for t in textos]))
+        for nome, regras, lista in casos:
+            for memo in (None, MemoParagrafos()):
+                debug_sequencial, debug_lote = [], []
+                sequencial = list(classificar_paragrafos(lista, debug_sequencial, memo, regras))
+                lote = classificar_paragrafos_lote(lista, debug_lote, memo, regras)
+                if (sequencial != lote or debug_sequencial != debug_lote) and (nome, i) not in divergentes:
+                    divergentes.append((nome, i))
+    return divergentes
+
+
+def verificar_backends(documentos):
+    """
+    Formata cada documento com cada backend de parágrafos e compara o
+    word/document.xml gerado byte a byte. Retorna os índices dos documentos
+    em que algum backend divergiu do python-docx.
+    """
+    import zipfile
+    from formatador import BACKENDS_PARAGRAFO, Formatador, MemoParagrafos
+
+    divergentes = []
+    for i, dados in enumerate(documentos):
+        saidas = {}
+        for backend in BACKENDS_PARAGRAFO:
+            formatador = Formatador(memo=MemoParagrafos(), backend_paragrafos=backend)
+            saida = formatador.formatar(io.BytesIO(dados))
+            saidas[backend] = zipfile.ZipFile(saida).read('word/document.xml')
+        if any(xml != saidas['python-docx'] for xml in saidas.values()):
+            divergentes.append(i)
+    return divergentes
+
+
+def _partes_docx(dados):
+    """Conteúdo de cada parte de um .docx, sem as datas gravadas no ZIP."""
+    import zipfile
+    with zipfile.ZipFile(io.BytesIO(dados)) as arquivo:
+        return {nome: arquivo.read(nome) for nome in arquivo.namelist()}
+
+
+def verificar_threads(documentos, threads=8, rodadas=4):
+    """
+    Teste de estresse do Formatador: formata os documentos em série e depois
+    rodadas vezes cada, embaralhados, em threads que compartilham o mesmo
+    Formatador, nos modos padrão e streaming, com e sem preservar_runs.
+    Retorna os (modo, índice) cujas partes divergiram da execução em série.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from formatador import Formatador
+
+    divergentes = []
+    for preservar_runs in (False, True):
+        formatador = Formatador(preservar_runs=preservar_runs)
+        for metodo in (formatador.formatar, formatador.formatar_streaming):
+            modo = f"{metodo.__name__}{'+runs' if preservar_runs else ''}"
+
+            def executar(i):
+                return _partes_docx(metodo(io.BytesIO(documentos[i])).getvalue())
+
+            serie = [executar(i) for i in range(len(documentos))]
+            indices = list(range(len(documentos))) * rodadas
+            random.Random(0).shuffle(indices)
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                for i, partes in zip(indices, executor.map(executar, indices)):
+                    if partes != serie[i] and (modo, i) not in divergentes:
+                        divergentes.append((modo, i))
+    return divergentes
+
+
+def _medir_etapa(nome, documentos, repeticoes, kwargs):
+    """Executado no processo filho: prepara a etapa, aquece e mede as repetições."""
+    n_paragrafos = _contar_paragrafos(documentos)
+    executar = ETAPAS[nome](documentos, **kwargs)
+    executar()  # Aquecimento (modelo timbrado, imports, caches do processo)
+
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        executar()
+        tempos.append(time.perf_counter() - inicio)
+
+    # ru_maxrss é em KB no Linux e em bytes no macOS
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pico_mb = pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024
+
+    melhor = min(tempos)
+    return {
+        'tempo_min_s': melhor,
+        'tempo_mediana_s': statistics.median(tempos),
+        'paragrafos': n_paragrafos,
+        'paragrafos_por_s': n_paragrafos / melhor if melhor else 0.0,
+        'pico_rss_mb': pico_mb,
+    }
+
+
+def medir(nome, documentos, repeticoes=3, **kwargs):
+    """Mede uma etapa em um processo novo, para que o pico de memória seja só dela."""
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as executor:
+        return executor.submit(_medir_etapa, nome, documentos, repeticoes, kwargs).result()
+
+
+# Módulos cujo tempo de importação a frio é medido com --importacao
+MODULOS_IMPORTACAO = ('regras', 'formatador', 'fila', 'documento')
+
+
+def medir_importacao(modulo, repeticoes=5):
+    """
+    Menor tempo (s) de importação do módulo em um interpretador novo, para que
+    nenhuma dependência já esteja carregada. Retorna None se o módulo não puder
+    ser importado (ex.: dependência ausente).
+    """
+    codigo = ("import time; inicio = time.perf_counter(); "
+              f"import {modulo}; print(time.perf_counter() - inicio)")
+    tempos = []
+    for _ in range(repeticoes):
+        processo = subprocess.run([sys.executable, '-c', codigo], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)))
+        if processo.returncode != 0:
+            return None
+        tempos.append(float(processo.stdout))
+    return min(tempos)
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def comparar(atual, anterior, tolerancia):
+    """
+    Imprime a variação de cada etapa em relação a um resultado anterior e
+    retorna a lista de etapas que ficaram mais lentas além da tolerância.
+    """
+    regressoes = []
+    print(f"\nComparação com {anterior.get('commit') or 'resultado anterior'}:")
+    for nome, medida in atual['etapas'].items():
+        base = anterior.get('etapas', {}).get(nome)
+        if not base:
+            continue
+        variacao = medida['tempo_min_s'] / base['tempo_min_s'] - 1
+        memoria = medida['pico_rss_mb'] - base['pico_rss_mb']
+        marca = ''
+        if variacao > tolerancia:
+            marca = '  <-- REGRESSÃO'
+            regressoes.append(nome)
+        print(f"  {nome:<20} tempo {variacao:+7.1%}   memória {memoria:+7.1f} MB{marca}")
+    for modulo, tempo in atual.get('importacao', {}).items():
+        base = anterior.get('importacao', {}).get(modulo)
+        if tempo and base:
+            print(f"  import {modulo:<13} tempo {tempo / base - 1:+7.1%}")
+    return regressoes
+
+
+def _ler_mix(texto):
+    mix = dict(MIX_PADRAO)
+    for item in texto.split(','):
+        if item.strip():
+            tipo, peso = item.split('=')
+            mix[tipo.strip()] = float(peso)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do formatador com petições sintéticas.")
+    parser.add_argument('--paragrafos', type=int, default=2000, help="Parágrafos por documento (padrão: %(default)s)")
+    parser.add_argument('--documentos', type=int, default=4, help="Documentos no lote (padrão: %(default)s)")
+    parser.add_argument('--tabelas', type=int, default=2, help="Tabelas por documento (padrão: %(default)s)")
+    parser.add_argument('--linhas-tabela', type=int, default=20, help="Linhas de cada tabela (padrão: %(default)s)")
+    parser.add_argument('--colunas-tabela', type=int, default=4, help="Colunas de cada tabela (padrão: %(default)s)")
+    parser.add_argument('--enfase', type=float, default=0.0,
+                        help="Fração dos parágrafos com trechos em negrito ou itálico (padrão: %(default)s)")
+    parser.add_argument('--mix', default='', help="Pesos dos tipos de parágrafo, ex.: normal=30,citacao=20")
+    parser.add_argument('--repeticoes', type=int, default=3, help="Repetições por etapa (padrão: %(default)s)")
+    parser.add_argument('--workers', type=int, default=1, help="Processos do fluxo completo (padrão: %(default)s)")
+    parser.add_argument('--etapas', default=','.join(ETAPAS), help="Etapas a medir, separadas por vírgula")
+    parser.add_argument('--saida', help="Salva os resultados em JSON")
+    parser.add_argument('--comparar', help="JSON de uma execução anterior para comparação")
+    parser.add_argument('--verificar-backends', action='store_true',
+                        help="Antes de medir, confere se os backends de parágrafos geram o mesmo XML")
+    parser.add_argument('--verificar-classificador', action='store_true',
+                        help="Antes de medir, confere as regras padrão contra o corpus de classificações "
+                             "da implementação original (corpus_classificador.json)")
+    parser.add_argument('--verificar-lote', action='store_true',
+                        help="Antes de medir, confere se a classificação em lote dá o mesmo resultado da "
+                             "sequencial, inclusive com regras em que 'secao_pedidos' abre a seção de pedidos")
+    parser.add_argument('--verificar-threads', action='store_true',
+                        help="Antes de medir, formata os documentos ao mesmo tempo em --workers threads "
+                             "e confere se o resultado é igual ao da execução em série")
+    parser.add_argument('--importacao', action='store_true',
+                        help="Mede também o tempo de importação a frio dos módulos principais")
+    parser.add_argument('--tolerancia', type=float, default=0.10,
+                        help="Aumento de tempo aceito antes de acusar regressão (padrão: %(default)s)")
+    args = parser.parse_args(argv)
+
+    mix = _ler_mix(args.mix)
+    if args.verificar_classificador:
+        divergentes = verificar_classificador()
+        for texto, em_pedidos, obtido, esperado in divergentes[:20]:
+            print(f"  {texto[:60]!r} (em_pedidos={em_pedidos}): {obtido} != {esperado}", file=sys.stderr)
+        if divergentes:
+            print(f"Classificador diverge do corpus em {len(divergentes)} caso(s).", file=sys.stderr)
+            return 1
+        print("Classificador reproduz o corpus de referência.", file=sys.stderr)
+
+    if args.verificar_lote:
+        divergentes = verificar_classificacao_lote(args.paragrafos, args.documentos, mix)
+        if divergentes:
+            print(f"Classificação em lote diverge da sequencial em {divergentes}.", file=sys.stderr)
+            return 1
+        print("Classificação em lote e sequencial são idênticas.", file=sys.stderr)
+
+    print(f"Gerando {args.documentos} petição(ões) de {args.paragrafos} parágrafos "
+          f"e {args.tabelas} tabela(s)...", file=sys.stderr)
+    documentos = [gerar_peticao(args.paragrafos, mix, args.tabelas, args.linhas_tabela, args.colunas_tabela,
+                                semente=i, enfase=args.enfase)
+                  for i in range(args.documentos)]
+
+    if args.verificar_backends:
+        divergentes = verificar_backends(documentos)
+        if divergentes:
+            print(f"Backends de parágrafos divergem nos documentos {divergentes}.", file=sys.stderr)
+            return 1
+        print("Backends de parágrafos geram XML idêntico.", file=sys.stderr)
+
+    if args.verificar_threads:
+        divergentes = verificar_threads(documentos, max(2, args.workers))
+        if divergentes:
+            print(f"Formatação concorrente diverge da em série em {divergentes}.", file=sys.stderr)
+            return 1
+        print("Formatação concorrente gera o mesmo resultado da em série.", file=sys.stderr)
+
+    resultado = {
+        'commit': _commit_atual(),
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'parametros': {
+            'paragrafos': args.paragrafos, 'documentos': args.documentos, 'tabelas': args.tabelas,
+            'linhas_tabela': args.linhas_tabela, 'colunas_tabela': args.colunas_tabela, 'mix': mix,
+            'enfase': args.enfase,
+            'repeticoes': args.repeticoes,
+            'workers': args.workers,
+        },
+        'etapas': {},
+    }
+
+    if args.importacao:
+        resultado['importacao'] = {}
+        print(f"{'importação':<20} {'tempo (ms)':>10}")
+        for modulo in MODULOS_IMPORTACAO:
+            tempo = medir_importacao(modulo, args.repeticoes)
+            resultado['importacao'][modulo] = tempo
+            print(f"{modulo:<20} {'indisponível' if tempo is None else f'{tempo * 1000:.1f}':>10}")
+
+    print(f"{'etapa':<20} {'tempo (s)':>10} {'parág./s':>12} {'pico RSS (MB)':>14}")
+    for nome in args.etapas.split(','):
+        nome = nome.strip()
+        kwargs = {'max_workers': args.workers} if nome == 'fluxo_completo' else {}
+        medida = medir(nome, documentos, args.repeticoes, **kwargs)
+        resultado['etapas'][nome] = medida
+        print(f"{nome:<20} {medida['tempo_min_s']:>10.3f} {medida['paragrafos_por_s']:>12,.0f} "
+              f"{medida['pico_rss_mb']:>14.1f}")
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            anterior = json.load(f)
+        if anterior.get('parametros') != resultado['parametros']:
+            print("Aviso: parâmetros diferentes dos da execução anterior.", file=sys.stderr)
+        if comparar(resultado, anterior, args.tolerancia):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Cache em disco de documentos já formatados, endereçado por conteúdo.
+"""
+import json
+import os
+import tempfile
+import threading
+
+# Configurações do cache de resultados
+CACHE_CONFIG = {
+    'diretorio': os.environ.get('FORMATADOR_CACHE_DIR',
+                                os.path.join(tempfile.gettempdir(), 'formatador_ica_cache')),
+    'tamanho_maximo': 512 * 1024 * 1024  # Bytes; os menos usados recentemente saem primeiro
+}
+
+
+class CacheResultados:
+    """
+    Guarda o .docx formatado (e a análise de depuração, quando houver) de cada
+    chave em um diretório, com remoção dos itens menos usados recentemente quando
+    o tamanho total passa do limite. A data de modificação dos arquivos registra
+    o último uso, então o cache pode ser compartilhado entre processos.
+
+    A chave deve identificar tudo o que influencia o resultado (entrada, logo e
+    configurações); ver formatador.chave_resultado.
+    """
+
+    def __init__(self, diretorio=None, tamanho_maximo=None):
+        self.diretorio = diretorio or CACHE_CONFIG['diretorio']
+        self.tamanho_maximo = tamanho_maximo or CACHE_CONFIG['tamanho_maximo']
+        self.acertos = 0
+        self.falhas = 0
+        self._trava = threading.Lock()
+        os.makedirs(self.diretorio, exist_ok=True)
+
+    def _caminhos(self, chave):
+        base = os.path.join(self.diretorio, chave)
+        return base + '.docx', base + '.debug.json'
+
+    def obter(self, chave, debug_mode=False):
+        """
+        Retorna (dados, debug_info) da chave ou None se não estiver em cache.
+        No modo de depuração, só há acerto se a análise também tiver sido guardada.
+        """
+        caminho_docx, caminho_debug = self._caminhos(chave)
+        try:
+            with open(caminho_docx, 'rb') as f:
+                dados = f.read()
+            debug_info = None
+            if debug_mode:
+                with open(caminho_debug, 'r', encoding='utf-8') as f:
+                    debug_info = json.load(f)
+            # Marcar como usado recentemente
+            os.utime(caminho_docx)
+        except (OSError, ValueError):
+            with self._trava:
+                self.falhas += 1
+            return None
+
+        with self._trava:
+            self.acertos += 1
+        return dados, debug_info
+
+    def guardar(self, chave, dados, debug_info=None):
+        """Grava o resultado de forma atômica e remove itens antigos se necessário."""
+        caminho_docx, caminho_debug = self._caminhos(chave)
+        if debug_info is not None:
+            self._gravar_atomico(caminho_debug,
+                                 json.dumps(debug_info, ensure_ascii=False).encode('utf-8'))
+        self._gravar_atomico(caminho_docx, dados)
+        self.remover_excedente()
+
+    def _gravar_atomico(self, caminho, dados):
+        fd, temporario = tempfile.mkstemp(dir=self.diretorio, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(dados)
+            os.replace(temporario, caminho)
+        except OSError:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+
+    def _itens(self):
+        """Lista (ultimo_uso, tamanho, caminhos) de cada chave, do mais antigo ao mais recente."""
+        itens = []
+        with os.scandir(self.diretorio) as entradas:
+            for entrada in entradas:
+                if not entrada.name.endswith('.docx'):
+                    continue
+                try:
+                    info = entrada.stat()
+                except OSError:
+                    continue
+                caminho_debug = entrada.path[:-len('.docx')] + '.debug.json'
+                tamanho = info.st_size
+                if os.path.exists(caminho_debug):
+                    tamanho += os.path.getsize(caminho_debug)
+                itens.append((info.st_mtime, tamanho, (entrada.path, caminho_debug)))
+        itens.sort()
+        return itens
+
+    def tamanho_total(self):
+        return sum(tamanho for _, tamanho, _ in self._itens())
+
+    def remover_excedente(self):
+        """Remove os itens menos usados recentemente até caber no tamanho máximo."""
+        itens = self._itens()
+        total = sum(tamanho for _, tamanho, _ in itens)
+        for _, tamanho, caminhos in itens:
+            if total <= self.tamanho_maximo:
+                break
+            for caminho in caminhos:
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    pass
+            total -= tamanho
+
+    def limpar(self):
+        for _, _, caminhos in self._itens():
+            for caminho in caminhos:
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    pass
+
+    def estatisticas(self):
+        """Retorna acertos, falhas, taxa de acerto e tamanho atual em disco."""
+        consultas = self.acertos + self.falhas
+        return {
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'taxa_acerto': self.acertos / consultas if consultas else 0.0,
+            'tamanho': self.tamanho_total(),
+        }
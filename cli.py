@@ -0,0 +1,185 @@
+"""
+Formatação em lote pela linha de comando, sem Streamlit.
+
+Exemplos:
+    python cli.py peticoes/ --saida formatados/
+    python cli.py "arquivo/**/*.docx" --workers 8 --logo logo.png --debug-json
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+from formatador import PROCESSAMENTO_CONFIG, executar_lote, formatar_caminho
+from instrumentacao import Instrumentacao
+from logo import preparar_logo_arquivo
+from regras import obter_regras
+
+
+def base_glob(padrao):
+    """Diretório formado pelas partes do padrão glob anteriores ao primeiro curinga."""
+    partes = []
+    for parte in os.path.normpath(padrao).split(os.sep):
+        if any(curinga in parte for curinga in '*?['):
+            break
+        partes.append(parte)
+    else:
+        partes = partes[:-1]  # Sem curingas: o padrão é o próprio arquivo
+    return os.sep.join(partes) or ('/' if padrao.startswith('/') else '.')
+
+
+def listar_documentos(entradas):
+    """
+    Expande diretórios (recursivamente), padrões glob e arquivos em uma lista de
+    tuplas (caminho, caminho_relativo), sem repetições e em ordem estável. O
+    caminho relativo é calculado a partir do diretório informado ou da parte do
+    padrão glob sem curingas, preservando as subpastas.
+    """
+    documentos = []
+    vistos = set()
+
+    def adicionar(caminho, base):
+        caminho = os.path.abspath(caminho)
+        # Ignorar arquivos temporários do Word (~$arquivo.docx)
+        if caminho in vistos or os.path.basename(caminho).startswith('~$'):
+            return
+        vistos.add(caminho)
+        documentos.append((caminho, os.path.relpath(caminho, base)))
+
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            for raiz, _, arquivos in sorted(os.walk(entrada)):
+                for nome in sorted(arquivos):
+                    if nome.lower().endswith('.docx'):
+                        adicionar(os.path.join(raiz, nome), entrada)
+        elif os.path.isfile(entrada):
+            adicionar(entrada, os.path.dirname(entrada) or '.')
+        else:
+            base = base_glob(entrada)
+            for caminho in sorted(glob.glob(entrada, recursive=True)):
+                if os.path.isfile(caminho) and caminho.lower().endswith('.docx'):
+                    adicionar(caminho, base)
+
+    return documentos
+
+
+def caminho_de_saida(relativo, pasta_saida):
+    """Gera o caminho de saída preservando a estrutura de pastas da entrada."""
+    nome_base = os.path.splitext(relativo)[0]
+    return os.path.join(pasta_saida, f"{nome_base}_FORMATADO.docx")
+
+
+def saidas_repetidas(saidas):
+    """Caminhos de saída gerados para mais de uma entrada (ex.: arquivos de mesmo nome em pastas diferentes)."""
+    contagem = {}
+    for saida in saidas:
+        chave = os.path.normcase(os.path.abspath(saida))
+        contagem[chave] = contagem.get(chave, 0) + 1
+    return sorted({saida for saida in saidas if contagem[os.path.normcase(os.path.abspath(saida))] > 1})
+
+
+def criar_parser():
+    parser = argparse.ArgumentParser(
+        description="Formata documentos jurídicos (.docx) no padrão ICA Advocacia."
+    )
+    parser.add_argument('entradas', nargs='+',
+                        help="Arquivos .docx, diretórios (percorridos recursivamente) ou padrões glob")
+    parser.add_argument('-o', '--saida', default='formatados',
+                        help="Diretório de saída (padrão: %(default)s)")
+    parser.add_argument('-w', '--workers', type=int, default=PROCESSAMENTO_CONFIG['max_workers'],
+                        help="Número de processos paralelos (padrão: %(default)s)")
+    parser.add_argument('--logo', default=None,
+                        help="Imagem do logo para o cabeçalho")
+    parser.add_argument('--debug-json', action='store_true',
+                        help="Salva a análise de parágrafos de cada documento em um .json ao lado da saída")
+    parser.add_argument('--streaming', action='store_true', default=None,
+                        help="Força o modo streaming (memória constante) para todos os arquivos; "
+                             "por padrão ele é usado só nos arquivos grandes")
+    parser.add_argument('--preservar-runs', action='store_true',
+                        help="Mantém negrito, itálico, sublinhado, tachado e sobrescrito/subscrito "
+                             "aplicados em trechos do texto original")
+    parser.add_argument('--regras',
+                        help="Arquivo JSON com regras de classificação e estilos próprios (ver regras.py)")
+    parser.add_argument('--relatorio',
+                        help="Salva em JSON a duração de cada etapa e a contagem de parágrafos por tipo, "
+                             "por arquivo e no total")
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="Mostra apenas erros e o resumo final")
+    return parser
+
+
+def main(argv=None):
+    args = criar_parser().parse_args(argv)
+
+    if args.logo and not os.path.exists(args.logo):
+        print(f"Logo não encontrado: {args.logo}", file=sys.stderr)
+        return 2
+    if args.logo:
+        # Reduzido uma vez ao tamanho de impressão, em vez de embutido no original em cada documento
+        try:
+            args.logo = preparar_logo_arquivo(args.logo)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+
+    if args.regras:
+        # Erros no arquivo de regras aparecem uma vez, e não em cada documento
+        try:
+            from documento import verificar_estilos  # O formatador vai precisar do python-docx de qualquer forma
+            verificar_estilos(obter_regras(args.regras))
+        except (OSError, ValueError) as e:
+            print(f"Regras inválidas: {e}", file=sys.stderr)
+            return 2
+
+    documentos = listar_documentos(args.entradas)
+    if not documentos:
+        print("Nenhum documento .docx encontrado.", file=sys.stderr)
+        return 1
+
+    saidas = [caminho_de_saida(relativo, args.saida) for _, relativo in documentos]
+    repetidas = saidas_repetidas(saidas)
+    if repetidas:
+        # Um documento sobrescreveria o outro (e, em paralelo, gravariam o mesmo arquivo ao mesmo tempo)
+        print("Entradas diferentes gerariam o mesmo arquivo de saída:", file=sys.stderr)
+        for saida in repetidas:
+            origens = [caminho for (caminho, _), outra in zip(documentos, saidas) if outra == saida]
+            print(f"  {saida}: {', '.join(origens)}", file=sys.stderr)
+        return 2
+
+    tarefas = []
+    for (caminho, _), saida in zip(documentos, saidas):
+        os.makedirs(os.path.dirname(saida) or '.', exist_ok=True)
+        tarefas.append((caminho, saida, args.logo, args.debug_json, args.streaming, bool(args.relatorio),
+                        args.preservar_runs, args.regras))
+
+    erros = 0
+    total = Instrumentacao()
+    relatorios = {}
+    for concluidos, (i, resultado, erro) in enumerate(executar_lote(formatar_caminho, tarefas, args.workers), 1):
+        caminho = documentos[i][0]
+        if erro is not None:
+            erros += 1
+            print(f"[{concluidos}/{len(tarefas)}] ERRO {caminho}: {erro}", file=sys.stderr)
+            continue
+
+        output_path, debug_info, relatorio = resultado
+        if relatorio is not None:
+            relatorios[caminho] = relatorio
+            total.mesclar(relatorio)
+        if args.debug_json:
+            with open(os.path.splitext(output_path)[0] + '.debug.json', 'w', encoding='utf-8') as f:
+                json.dump(debug_info, f, ensure_ascii=False, indent=2)
+        if not args.quiet:
+            print(f"[{concluidos}/{len(tarefas)}] {output_path}")
+
+    if args.relatorio:
+        with open(args.relatorio, 'w', encoding='utf-8') as f:
+            json.dump({'total': total.relatorio(), 'arquivos': relatorios}, f, ensure_ascii=False, indent=2)
+
+    print(f"{len(tarefas) - erros} documento(s) formatado(s), {erros} erro(s).", file=sys.stderr)
+    return 1 if erros else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Análise das informações de depuração (debug_info) de um documento formatado.
+
+AnaliseDepuracao indexa os parágrafos por posição e por tipo e detecta os
+possíveis problemas de classificação em uma única passada, para que o painel
+de depuração continue interativo em documentos com milhares de parágrafos.
+A interface mostra uma página de linhas por vez (ver pagina).
+"""
+from collections import Counter, defaultdict
+
+DEPURACAO_CONFIG = {
+    'linhas_por_pagina': 100,
+    'paragrafos_apos_pedidos': 5,  # Parágrafos verificados após cada cabeçalho de Pedidos
+}
+
+
+class AnaliseDepuracao:
+    """
+    Índices e problemas detectados no debug_info de um documento.
+
+    por_indice mapeia o índice do parágrafo no documento para sua posição em
+    paragrafos; por_tipo, o tipo detectado para a lista de posições. problemas
+    lista, na ordem do documento, dicionários com "Parágrafo", "Texto" e
+    "Problema".
+    """
+
+    def __init__(self, debug_info):
+        self.paragrafos = debug_info
+        self.por_indice = {}
+        self.por_tipo = defaultdict(list)
+        self.problemas = []
+
+        restantes = 0  # Parágrafos que ainda devem ser verificados após um cabeçalho de Pedidos
+        for posicao, item in enumerate(debug_info):
+            texto = item["texto"]
+            tipo = item["tipo_detectado"]
+            self.por_indice[item["index"]] = posicao
+            self.por_tipo[tipo].append(posicao)
+
+            if "Doc." in texto and tipo != "item_doc":
+                self._problema(item, f"Item Doc. detectado como '{tipo}'")
+            if "•" in texto and tipo not in ("subsecao", "lista"):
+                self._problema(item, f"Marcador • detectado como '{tipo}'")
+
+            maiusculo = texto.upper()
+            cabecalho_pedidos = 'PEDIDOS' in maiusculo or 'POR TUDO ISSO' in maiusculo
+            if cabecalho_pedidos:
+                if tipo != "secao_pedidos":
+                    self._problema(item, f"Seção de Pedidos detectada como '{tipo}' (deveria ser 'secao_pedidos')")
+                elif item["alinhamento"] != "justify":
+                    self._problema(item, f"Alinhamento incorreto na seção de Pedidos: '{item['alinhamento']}' "
+                                         f"(deveria ser 'justify')")
+
+            if restantes and texto.strip():
+                restantes -= 1
+                if item["alinhamento"] != "justify":
+                    self._problema(item, f"Parágrafo após Pedidos com alinhamento '{item['alinhamento']}' "
+                                         f"(deveria ser 'justify')")
+
+            if cabecalho_pedidos and tipo == "secao_pedidos":
+                restantes = DEPURACAO_CONFIG['paragrafos_apos_pedidos']
+
+    def _problema(self, item, descricao):
+        self.problemas.append({"Parágrafo": item["index"], "Texto": item["texto"], "Problema": descricao})
+
+    def paragrafo(self, indice):
+        """Retorna o item do parágrafo com o índice no documento, ou None."""
+        posicao = self.por_indice.get(indice)
+        return self.paragrafos[posicao] if posicao is not None else None
+
+    def contagem_tipos(self):
+        """Counter de parágrafos por tipo detectado."""
+        return Counter({tipo: len(posicoes) for tipo, posicoes in self.por_tipo.items()})
+
+    def _posicoes(self, tipo):
+        return self.por_tipo.get(tipo, []) if tipo is not None else range(len(self.paragrafos))
+
+    def paginas(self, tipo=None, tamanho=None):
+        """Número de páginas de linhas (ao menos 1), opcionalmente só do tipo."""
+        tamanho = tamanho or DEPURACAO_CONFIG['linhas_por_pagina']
+        return max(1, -(-len(self._posicoes(tipo)) // tamanho))
+
+    def pagina(self, numero, tipo=None, tamanho=None):
+        """Linhas da tabela de parágrafos da página numero (a partir de 1), opcionalmente só do tipo."""
+        tamanho = tamanho or DEPURACAO_CONFIG['linhas_por_pagina']
+        inicio = (numero - 1) * tamanho
+        return [{
+            "#": item["index"],
+            "Texto": item["texto"],
+            "Tipo": item["tipo_detectado"],
+            "Negrito": "Sim" if item["negrito"] else "Não",
+            "Alinhamento": item["alinhamento"],
+        } for item in (self.paragrafos[posicao] for posicao in self._posicoes(tipo)[inicio:inicio + tamanho])]
@@ -0,0 +1,911 @@
+"""
+Construção dos documentos formatados com o python-docx e o lxml: estilos,
+papel timbrado, parágrafos, tabelas e o núcleo de formatação (Formatador).
+
+Separado de formatador.py para que quem só classifica parágrafos, calcula
+chaves ou monta ZIPs não pague a importação do python-docx; os nomes daqui
+continuam disponíveis em formatador, carregados na primeira vez que são usados.
+"""
+from docx import Document
+from docx.document import Document as DocumentoDocx
+from docx.shared import Pt, RGBColor, Inches, Cm, Emu
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.enum.style import WD_STYLE_TYPE
+from docx.oxml.ns import nsdecls, nsmap, qn
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.parser import element_class_lookup
+from docx.oxml.table import CT_Tbl
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
+from lxml import etree
+import re
+import os
+import zipfile
+import io
+import copy
+import threading
+from xml.sax.saxutils import escape, quoteattr
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache
+
+from formatador import (ESTILOS_CONFIG, FORMATO_CONFIG, MEMO_PARAGRAFOS, PROCESSAMENTO_CONFIG, RODAPE_CONFIG,
+                        MemoParagrafos, chave_modelo_timbrado, classificar_paragrafos, classificar_paragrafos_lote,
+                        estilos_regras)
+from instrumentacao import etapa
+from logo import LOGO_CONFIG
+from regras import obter_regras
+
+ALINHAMENTOS = {
+    'center': WD_ALIGN_PARAGRAPH.CENTER,
+    'justify': WD_ALIGN_PARAGRAPH.JUSTIFY,
+    'left': WD_ALIGN_PARAGRAPH.LEFT,
+}
+
+# Moldura que estende o rodapé além das margens, com altura fixa
+MOLDURA_RODAPE_XML = (f'<w:framePr {nsdecls("w")} w:w="13000" w:h="2500" w:wrap="around" '
+                      'w:vAnchor="page" w:hAnchor="page" w:xAlign="center"/>')
+
+
+@lru_cache(maxsize=64)
+def _fragmento(xml):
+    return parse_xml(xml)
+
+
+def fragmento_xml(xml):
+    """
+    Retorna uma cópia nova do elemento descrito por xml. Cada XML é interpretado
+    uma única vez; o elemento em cache nunca é alterado, então várias threads
+    podem copiá-lo ao mesmo tempo.
+    """
+    return copy.deepcopy(_fragmento(xml))
+
+
+def cor_hex(cor_rgb):
+    return '{:02x}{:02x}{:02x}'.format(*cor_rgb)
+
+
+def criar_cabecalho(doc, logo_path=None):
+    """
+    Cria cabeçalho com logo ICA centralizado.
+    """
+    section = doc.sections[0]
+    header = section.header
+
+    # Limpar cabeçalho existente
+    for para in header.paragraphs:
+        para.clear()
+
+    # Criar parágrafo para o logo
+    p = header.paragraphs[0] if header.paragraphs else header.add_paragraph()
+    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    # Adicionar logo se fornecido
+    if logo_path and os.path.exists(logo_path):
+        run = p.add_run()
+        run.add_picture(logo_path, width=Inches(LOGO_CONFIG['largura_polegadas']))
+
+    # Espaçamento após o logo
+    p.paragraph_format.space_after = Pt(24)
+    p.paragraph_format.space_before = Pt(12)
+
+
+def criar_rodape(doc, config):
+    """
+    Cria rodapé personalizado com fundo colorido e informações do escritório.
+    """
+    section = doc.sections[0]
+    footer = section.footer
+
+    # Salvar as margens originais do documento
+    original_left_margin = section.left_margin
+    original_right_margin = section.right_margin
+
+    # Limpar rodapé existente
+    for para in footer.paragraphs:
+        para.clear()
+
+    # Criar parágrafo do rodapé
+    p = footer.paragraphs[0] if footer.paragraphs else footer.add_paragraph()
+    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    # Adicionar fundo colorido
+    p._element.get_or_add_pPr().append(
+        fragmento_xml(f'<w:shd {nsdecls("w")} w:fill="{cor_hex(config["cor_fundo"])}"/>'))
+
+    # Configurar altura do parágrafo para aproximadamente 2.4 cm
+    p.paragraph_format.space_before = Pt(50)
+    p.paragraph_format.space_after = Pt(50)
+
+    # Adicionar espaço antes do texto para centralizá-lo verticalmente
+    run_space_before = p.add_run("\n\n")  # Adiciona espaço no início
+    run_space_before.font.size = Pt(2)  # Tamanho menor para controle fino
+
+    # Linha 1: Endereço
+    run1 = p.add_run(config['endereco'])
+    run1.font.color.rgb = RGBColor(*config['cor_texto'])
+    run1.font.size = Pt(10)
+    run1.font.name = 'Arial'
+
+    # Linha 2: Telefone e email
+    p.add_run('\n')
+    run2 = p.add_run(f"{config['telefone']} | {config['email']}")
+    run2.font.color.rgb = RGBColor(*config['cor_texto'])
+    run2.font.size = Pt(10)
+    run2.font.name = 'Arial'
+    p.add_run("\n\n\n")  # Add extra lines at the bottom
+
+
+def adicionar_linha_horizontal(paragrafo, cor_rgb=(192, 192, 192)):
+    """Adiciona borda inferior a um parágrafo ou a um estilo de parágrafo."""
+    # w:sz é a espessura da linha, em oitavos de ponto
+    paragrafo._element.get_or_add_pPr().append(fragmento_xml(
+        f'<w:pBdr {nsdecls("w")}><w:bottom w:val="single" w:sz="6" w:space="1" w:color="{cor_hex(cor_rgb)}"/>'
+        '</w:pBdr>'))
+
+
+def aplicar_formatacao_paragrafo(paragrafo, alinhamento='justify', negrito=False,
+                                 italico=False, tamanho_fonte=12, espacamento_antes=6,
+                                 espacamento_depois=6, espacamento_linha=1.5, 
+                                 cor_texto=None, recuo_lista=False, recuo_primeira_linha=True):
+    # Alinhamento
+    if alinhamento == 'center':
+        paragrafo.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    elif alinhamento == 'justify':
+        paragrafo.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+    elif alinhamento == 'left':
+        paragrafo.alignment = WD_ALIGN_PARAGRAPH.LEFT
+
+    # Espaçamento
+    paragrafo.paragraph_format.space_before = Pt(espacamento_antes)
+    paragrafo.paragraph_format.space_after = Pt(espacamento_depois)
+    paragrafo.paragraph_format.line_spacing = espacamento_linha
+
+    # Recuo para itens de lista ou primeira linha
+    if recuo_lista:
+        paragrafo.paragraph_format.left_indent = Inches(0.25)
+        paragrafo.paragraph_format.first_line_indent = Inches(-0.25)
+    elif recuo_primeira_linha:
+        paragrafo.paragraph_format.first_line_indent = Cm(1.27)  # 0.5 polegadas
+
+    # Formatação de fonte
+    for run in paragrafo.runs:
+        run.font.name = 'Arial'
+        run.font.size = Pt(tamanho_fonte)
+        run.bold = negrito
+        run.italic = italico
+        if cor_texto:
+            run.font.color.rgb = RGBColor(*cor_texto)
+
+
+def criar_estilo_paragrafo(doc, nome, alinhamento='justify', negrito=False,
+                           italico=False, tamanho_fonte=12, espacamento_antes=6,
+                           espacamento_depois=6, espacamento_linha=1.5,
+                           cor_texto=None, recuo_lista=False, recuo_primeira_linha=True,
+                           linha_horizontal=False):
+    """
+    Cria um estilo de parágrafo com a mesma formatação que
+    aplicar_formatacao_paragrafo aplicaria diretamente em cada parágrafo.
+    """
+    estilo = doc.styles.add_style(nome, WD_STYLE_TYPE.PARAGRAPH)
+    estilo.base_style = doc.styles['Normal']
+    estilo.quick_style = True
+
+    formato = estilo.paragraph_format
+    formato.alignment = ALINHAMENTOS[alinhamento]
+    formato.space_before = Pt(espacamento_antes)
+    formato.space_after = Pt(espacamento_depois)
+    formato.line_spacing = espacamento_linha
+
+    # Recuo para itens de lista ou primeira linha
+    if recuo_lista:
+        formato.left_indent = Inches(0.25)
+        formato.first_line_indent = Inches(-0.25)
+    elif recuo_primeira_linha:
+        formato.first_line_indent = Cm(1.27)  # 0.5 polegadas
+
+    # Formatação de fonte
+    estilo.font.name = FORMATO_CONFIG['fonte_padrao']
+    estilo.font.size = Pt(tamanho_fonte)
+    estilo.font.bold = negrito
+    estilo.font.italic = italico
+    if cor_texto:
+        estilo.font.color.rgb = RGBColor(*cor_texto)
+
+    if linha_horizontal:
+        adicionar_linha_horizontal(estilo, FORMATO_CONFIG['cor_linha'])
+
+    return estilo
+
+
+def criar_estilos(doc, estilos=None):
+    """Cria no documento um estilo de parágrafo para cada tipo de estilos (por padrão, ESTILOS_CONFIG)."""
+    for config in (estilos or ESTILOS_CONFIG).values():
+        criar_estilo_paragrafo(doc, **config)
+
+
+def elemento_paragrafo(texto, estilo_id):
+    """Cria um elemento w:p com um único run, como add_paragraph(texto) o criaria."""
+    p = OxmlElement('w:p')
+    p.style = estilo_id
+    Paragraph(p, None).add_run(texto)
+    return p
+
+
+W_PPR = qn('w:pPr')
+W_PSTYLE = qn('w:pStyle')
+W_VAL = qn('w:val')
+W_R = qn('w:r')
+W_T = qn('w:t')
+W_TAB = qn('w:tab')
+W_BR = qn('w:br')
+XML_SPACE = qn('xml:space')
+_RE_QUEBRAS = re.compile(r'([\t\n\r])')
+
+
+def elemento_paragrafo_lxml(texto, estilo_id):
+    """
+    Mesmo elemento de elemento_paragrafo, criado diretamente com o lxml, sem os
+    objetos do python-docx (que percorrem o texto caractere a caractere).
+    """
+    p = OxmlElement('w:p')
+    etree.SubElement(etree.SubElement(p, W_PPR), W_PSTYLE).set(W_VAL, estilo_id)
+    _preencher_run(etree.SubElement(p, W_R), texto)
+    return p
+
+
+def _preencher_run(r, texto):
+    """Acrescenta ao run o texto, com tabulações como w:tab e quebras de linha como w:br."""
+    for trecho in _RE_QUEBRAS.split(texto):
+        if trecho == '\t':
+            etree.SubElement(r, W_TAB)
+        elif trecho in ('\n', '\r'):
+            etree.SubElement(r, W_BR)
+        elif trecho:
+            t = etree.SubElement(r, W_T)
+            t.text = trecho
+            if len(trecho.strip()) < len(trecho):
+                t.set(XML_SPACE, 'preserve')
+
+
+# Formas de construir os parágrafos; todas geram exatamente o mesmo XML
+BACKENDS_PARAGRAFO = {
+    'lxml': elemento_paragrafo_lxml,
+    'python-docx': elemento_paragrafo,
+}
+
+
+def criar_elemento_paragrafo(texto, estilo_id):
+    """Cria o elemento w:p do parágrafo com o backend configurado em PROCESSAMENTO_CONFIG."""
+    return BACKENDS_PARAGRAFO[PROCESSAMENTO_CONFIG['backend_paragrafos']](texto, estilo_id)
+
+
+W_RPR = qn('w:rPr')
+_XPATH_RUNS = etree.XPath('w:r | w:hyperlink/w:r', namespaces=nsmap)
+
+# Propriedades de run mantidas no modo preservar_runs, na ordem do esquema do
+# rPr. Só a ênfase é mantida: fonte, tamanho e cor vêm do estilo do escritório.
+ENFASES_RUN = ('w:b', 'w:i', 'w:strike', 'w:u', 'w:vertAlign')
+_ORDEM_ENFASES = {qn(nome): (i, nome) for i, nome in enumerate(ENFASES_RUN)}
+_TAGS_ENFASES = {nome: qn(nome) for nome in ENFASES_RUN}
+_VALORES_DESLIGADOS = {'0', 'false', 'off', 'none', 'baseline'}
+W_RSTYLE = qn('w:rStyle')
+W_STYLE = qn('w:style')
+W_STYLE_ID = qn('w:styleId')
+W_TYPE = qn('w:type')
+W_BASED_ON = qn('w:basedOn')
+
+
+def _aplicar_enfase(propriedades, rpr):
+    """
+    Aplica a propriedades (ordem -> (nome, valor)) a ênfase do rPr: as
+    propriedades ligadas substituem as anteriores e as desligadas as removem.
+    """
+    for propriedade in rpr:
+        ordem = _ORDEM_ENFASES.get(propriedade.tag)
+        if ordem is None:
+            continue
+        valor = propriedade.get(W_VAL)
+        if valor in _VALORES_DESLIGADOS:
+            propriedades.pop(ordem[0], None)
+            continue
+        nome = ordem[1]
+        if nome == 'w:u':
+            valor = valor or 'single'
+        elif nome == 'w:vertAlign':
+            if valor is None:
+                continue
+        else:
+            valor = None
+        propriedades[ordem[0]] = (nome, valor)
+
+
+def enfases_estilos_caractere(estilos):
+    """
+    Mapeia o styleId de cada estilo de caractere do elemento w:styles da entrada
+    para a ênfase que ele aplica (ordem -> (nome, valor), como em enfase_run),
+    incluindo a herdada pelo basedOn.
+    """
+    elementos = {}
+    for estilo in estilos.findall(W_STYLE):
+        if estilo.get(W_TYPE) == 'character' and estilo.get(W_STYLE_ID):
+            elementos[estilo.get(W_STYLE_ID)] = estilo
+
+    enfases = {}
+
+    def resolver(estilo_id, visitados):
+        if estilo_id in enfases:
+            return enfases[estilo_id]
+        estilo = elementos.get(estilo_id)
+        if estilo is None or estilo_id in visitados:  # Estilo inexistente ou basedOn circular
+            return {}
+        visitados.add(estilo_id)
+        base = estilo.find(W_BASED_ON)
+        propriedades = dict(resolver(base.get(W_VAL), visitados)) if base is not None else {}
+        rpr = estilo.find(W_RPR)
+        if rpr is not None:
+            _aplicar_enfase(propriedades, rpr)
+        enfases[estilo_id] = propriedades
+        return propriedades
+
+    for estilo_id in elementos:
+        resolver(estilo_id, set())
+    return enfases
+
+
+def enfase_run(r, enfases_estilos=None):
+    """
+    Retorna a ênfase do run, como uma tupla de (propriedade, valor) na ordem de
+    ENFASES_RUN; valor é None nas propriedades liga/desliga. Com
+    enfases_estilos (ver enfases_estilos_caractere), a ênfase do estilo de
+    caractere do run (w:rStyle) também vale, e a aplicada diretamente ao run
+    prevalece sobre ela. Propriedades desligadas explicitamente são ignoradas,
+    para que o estilo do parágrafo prevaleça.
+    """
+    rpr = r.find(W_RPR)
+    if rpr is None:
+        return ()
+    propriedades = {}
+    if enfases_estilos:
+        estilo = rpr.find(W_RSTYLE)
+        if estilo is not None:
+            propriedades.update(enfases_estilos.get(estilo.get(W_VAL), ()))
+    _aplicar_enfase(propriedades, rpr)
+    return tuple(propriedades[ordem] for ordem in sorted(propriedades))
+
+
+def trechos_paragrafo(p, enfases_estilos=None):
+    """
+    Retorna os trechos (texto, enfase) de um elemento w:p da entrada, um por
+    sequência de runs vizinhos com a mesma ênfase (incluindo os runs de
+    hyperlinks), sem espaços nas pontas do parágrafo. O texto dos trechos
+    concatenado é igual a p.text.strip(). enfases_estilos é passado a enfase_run.
+    """
+    trechos = []
+    for r in _XPATH_RUNS(p):
+        texto = r.text
+        if not texto:
+            continue
+        enfase = enfase_run(r, enfases_estilos)
+        if trechos and trechos[-1][1] == enfase:
+            trechos[-1] = (trechos[-1][0] + texto, enfase)
+        else:
+            trechos.append((texto, enfase))
+
+    while trechos and not trechos[0][0].lstrip():
+        del trechos[0]
+    while trechos and not trechos[-1][0].rstrip():
+        del trechos[-1]
+    if trechos:
+        trechos[0] = (trechos[0][0].lstrip(), trechos[0][1])
+        trechos[-1] = (trechos[-1][0].rstrip(), trechos[-1][1])
+    return tuple(trechos)
+
+
+def texto_trechos(trechos):
+    """Texto completo de um parágrafo dividido por trechos_paragrafo."""
+    return ''.join(texto for texto, _ in trechos)
+
+
+def elemento_paragrafo_runs(trechos, estilo_id):
+    """
+    Cria um elemento w:p com um run por trecho (texto, enfase), cada um com a
+    ênfase do trecho sobre o estilo informado.
+    """
+    p = OxmlElement('w:p')
+    etree.SubElement(etree.SubElement(p, W_PPR), W_PSTYLE).set(W_VAL, estilo_id)
+    for texto, enfase in trechos:
+        r = etree.SubElement(p, W_R)
+        if enfase:
+            rpr = etree.SubElement(r, W_RPR)
+            for nome, valor in enfase:
+                propriedade = etree.SubElement(rpr, _TAGS_ENFASES[nome])
+                if valor is not None:
+                    propriedade.set(W_VAL, valor)
+        _preencher_run(r, texto)
+    return p
+
+
+@lru_cache(maxsize=1)
+def _estilos_documento_base():
+    return frozenset(estilo.name.lower() for estilo in Document().styles if estilo.name)
+
+
+def verificar_estilos(regras=None):
+    """
+    Lança ValueError se o nome de algum estilo (os padrão ou os do ConjuntoRegras)
+    já existir no documento base do python-docx, em que add_style falharia.
+    """
+    base = _estilos_documento_base()
+    for tipo, config in estilos_regras(regras).items():
+        if config['nome'].lower() in base:
+            raise ValueError(f"Estilo '{tipo}': o nome '{config['nome']}' já existe no documento base")
+
+
+class ModeloTimbrado:
+    """
+    Papel timbrado pré-construído: margens, estilos, cabeçalho com logo e rodapé.
+
+    O modelo é montado e serializado uma única vez; cada documento novo é
+    carregado a partir desses bytes, de modo que o custo por documento fica
+    restrito ao corpo do texto. Com um ConjuntoRegras, os estilos dos tipos
+    definidos nele também são criados.
+    """
+
+    def __init__(self, logo_path=None, regras=None):
+        verificar_estilos(regras)
+        estilos_config = estilos_regras(regras)
+        doc = Document()
+
+        # Configurar margens para o corpo do documento
+        sections = doc.sections
+        for section in sections:
+            section.top_margin = Cm(2.5)
+            section.bottom_margin = Cm(2.5)
+            section.left_margin = Cm(3)
+            section.right_margin = Cm(2)
+
+        # Adicionar cabeçalho com logo
+        criar_cabecalho(doc, logo_path)
+
+        # Estilos de parágrafo compartilhados pelo corpo do documento
+        criar_estilos(doc, estilos_config)
+
+        # Configuração especial para o rodapé de página inteira
+        # Obter a última seção do documento (onde o rodapé será aplicado)
+        last_section = doc.sections[-1]
+
+        # Fazer uma cópia das margens originais do documento
+        original_left = last_section.left_margin
+        original_right = last_section.right_margin
+
+        # Adicionar rodapé com as margens padrão
+        criar_rodape(doc, RODAPE_CONFIG)
+
+        # Modificar as propriedades do rodapé para ocupar a largura total
+        footer = last_section.footer
+
+        # Aplicar estilo especial ao parágrafo do rodapé
+        for p in footer.paragraphs:
+            if p.text.strip():  # Se não estiver vazio
+                # Estender o parágrafo além das margens
+                p_format = p.paragraph_format
+
+                # Usar valores XML diretos para estender além das margens
+                p_element = p._element.get_or_add_pPr()
+
+                # Adicionar configuração de moldura para estender além das margens com altura fixa
+                p_element.append(fragmento_xml(MOLDURA_RODAPE_XML))
+
+                # Definir espaçamento interno para o rodapé ter altura de 2.4cm
+                p.paragraph_format.space_before = Pt(50)  # Aproximadamente 1.2 cm
+                p.paragraph_format.space_after = Pt(50)   # Aproximadamente 1.2 cm
+
+        # Dados usados pelo modo streaming, que não abre o modelo como Document
+        self.estilos = {tipo: doc.styles[config['nome']].style_id for tipo, config in estilos_config.items()}
+        self.estilo_tabela = doc.styles['Light Grid Accent 1'].style_id
+        self.largura_util = last_section.page_width - last_section.left_margin - last_section.right_margin
+
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        self.dados = buffer.getvalue()
+
+    def novo_documento(self):
+        """Retorna um novo Document com o papel timbrado e o corpo vazio."""
+        return Document(io.BytesIO(self.dados))
+
+
+# Modelos já construídos, do mais antigo ao mais recente uso, protegidos pela
+# trava por serem consultados por várias threads
+_MODELOS_TIMBRADOS = OrderedDict()
+_MAX_MODELOS_TIMBRADOS = 8
+_TRAVA_MODELOS = threading.Lock()
+
+def obter_modelo_timbrado(logo_path=None, regras_path=None):
+    """
+    Retorna o papel timbrado para o logo e o arquivo de regras informados,
+    construindo-o só na primeira vez.
+    """
+    chave = chave_modelo_timbrado(logo_path, regras_path)
+    with _TRAVA_MODELOS:
+        modelo = _MODELOS_TIMBRADOS.get(chave)
+        if modelo is not None:
+            _MODELOS_TIMBRADOS.move_to_end(chave)
+            return modelo
+
+    # Construído fora da trava; se duas threads o construírem ao mesmo tempo, fica o primeiro
+    modelo = ModeloTimbrado(logo_path, obter_regras(regras_path))
+    with _TRAVA_MODELOS:
+        modelo = _MODELOS_TIMBRADOS.setdefault(chave, modelo)
+        _MODELOS_TIMBRADOS.move_to_end(chave)
+        if len(_MODELOS_TIMBRADOS) > _MAX_MODELOS_TIMBRADOS:
+            _MODELOS_TIMBRADOS.popitem(last=False)
+    return modelo
+
+
+W_BODY = qn('w:body')
+W_P = qn('w:p')
+W_TBL = qn('w:tbl')
+
+
+def blocos_do_corpo(doc):
+    """Gera os parágrafos (w:p) e tabelas (w:tbl) do corpo do documento, na ordem em que aparecem."""
+    return doc.element.body.iterchildren(W_P, W_TBL)
+
+
+def copiar_tabela(tbl, modelo):
+    """
+    Reconstrói uma tabela da entrada (w:tbl) no padrão do papel timbrado,
+    percorrendo linhas e células uma única vez. Cada célula recebe o texto da
+    original em um único run, a primeira linha é formatada como cabeçalho e as
+    células mescladas (gridSpan e vMerge) continuam mescladas.
+    """
+    grade = tbl.find(qn('w:tblGrid'))
+    colunas = len(grade) if grade is not None else 0
+    if colunas == 0:
+        colunas = max((sum(tc.grid_span for tc in tr.tc_lst) for tr in tbl.tr_lst), default=0)
+
+    nova = CT_Tbl.new_tbl(0, colunas, modelo.largura_util)
+    nova.tblStyle_val = modelo.estilo_tabela
+    largura_coluna = modelo.largura_util // colunas if colunas else 0
+
+    for i, tr in enumerate(tbl.tr_lst):
+        nova_tr = nova.add_tr()
+        # Células omitidas no início ou no fim da linha
+        if tr.trPr is not None:
+            for omitidas in tr.trPr.iterchildren(qn('w:gridBefore'), qn('w:gridAfter')):
+                nova_tr.get_or_add_trPr().append(copy.deepcopy(omitidas))
+
+        for tc in tr.tc_lst:
+            nova_tc = nova_tr.add_tc()
+            extensao = tc.grid_span
+            nova_tc.width = Emu(largura_coluna * extensao)
+            if extensao > 1:
+                nova_tc.grid_span = extensao
+            if tc.vMerge is not None:
+                nova_tc.vMerge = tc.vMerge
+
+            # Mesmo resultado de _Cell.text = texto: um parágrafo com um único run
+            nova_tc.clear_content()
+            run = nova_tc.add_p().add_r()
+            run.text = '\n'.join(p.text for p in tc.p_lst)
+            # Formatar primeira linha como cabeçalho
+            if i == 0:
+                fonte = Run(run, None).font
+                fonte.bold = True
+                fonte.size = Pt(11)
+
+    return nova
+
+
+def formatar_documento(doc_entrada, doc_saida=None, logo_path=None, debug_mode=False, memo=None,
+                       instrumentacao=None, preservar_runs=False, regras_path=None):
+    """
+    Formata um documento jurídico no padrão do escritório.
+
+    doc_entrada pode ser um Document já aberto, um caminho ou um objeto de arquivo.
+    doc_saida pode ser um caminho ou um objeto de arquivo; se omitido, o documento
+    é gravado em um BytesIO. Retorna o destino (e debug_info, no modo de depuração).
+
+    memo é o MemoParagrafos usado para reaproveitar parágrafos já formatados
+    (por padrão, MEMO_PARAGRAFOS). Com uma Instrumentacao, registra a duração
+    de cada etapa e a contagem de parágrafos por tipo.
+
+    Com preservar_runs, negrito, itálico, sublinhado, tachado e
+    sobrescrito/subscrito aplicados no texto original, diretamente ou por um
+    estilo de caractere, são mantidos sobre o estilo do escritório, com os runs
+    vizinhos de mesma ênfase unidos.
+
+    regras_path é um arquivo de regras (ver regras.py) com tipos e estilos
+    próprios; sem ele, valem as regras padrão.
+
+    Equivale a Formatador(logo_path, regras_path, preservar_runs, memo).formatar(...),
+    com a configuração lida dos dicionários do módulo a cada chamada.
+    """
+    with etapa(instrumentacao, 'modelo_timbrado'):
+        formatador = Formatador(logo_path, regras_path, preservar_runs, memo or MEMO_PARAGRAFOS)
+    return formatador.formatar(doc_entrada, doc_saida, debug_mode, instrumentacao)
+
+
+def xml_paragrafo(texto, estilo_id):
+    """
+    Serializa um parágrafo com um único run, como add_paragraph(texto) o criaria:
+    tabulações viram w:tab e quebras de linha viram w:br.
+    """
+    # O id vem do nome do estilo, que um arquivo de regras pode definir livremente
+    partes = ['<w:p><w:pPr><w:pStyle w:val=', quoteattr(estilo_id), '/></w:pPr><w:r>']
+    _serializar_texto_run(partes, texto)
+    partes.append('</w:r></w:p>')
+    return ''.join(partes).encode('utf-8')
+
+
+def _serializar_texto_run(partes, texto):
+    for trecho in _RE_QUEBRAS.split(texto):
+        if trecho == '\t':
+            partes.append('<w:tab/>')
+        elif trecho in ('\n', '\r'):
+            partes.append('<w:br/>')
+        elif trecho:
+            if len(trecho.strip()) < len(trecho):
+                partes.append('<w:t xml:space="preserve">')
+            else:
+                partes.append('<w:t>')
+            partes.append(escape(trecho))
+            partes.append('</w:t>')
+
+
+def xml_paragrafo_runs(trechos, estilo_id):
+    """Serializa o mesmo parágrafo de elemento_paragrafo_runs."""
+    partes = ['<w:p><w:pPr><w:pStyle w:val=', quoteattr(estilo_id), '/></w:pPr>']
+    for texto, enfase in trechos:
+        partes.append('<w:r>')
+        if enfase:
+            partes.append('<w:rPr>')
+            for nome, valor in enfase:
+                if valor is None:
+                    partes.append(f'<{nome}/>')
+                else:
+                    partes.append(f'<{nome} w:val={quoteattr(valor)}/>')
+            partes.append('</w:rPr>')
+        _serializar_texto_run(partes, texto)
+        partes.append('</w:r>')
+    partes.append('</w:p>')
+    return ''.join(partes).encode('utf-8')
+
+
+def xml_tabela(tbl, modelo):
+    """Reconstrói uma tabela da entrada como o modo padrão a reconstruiria."""
+    return etree.tostring(copiar_tabela(tbl, modelo), encoding='utf-8')
+
+
+def _iterar_corpo(stream, destino, modelo, trechos=None, enfases_estilos=None):
+    """
+    Percorre o word/document.xml da entrada com iterparse e gera o texto de cada
+    parágrafo do corpo. As tabelas encontradas são gravadas diretamente em
+    destino, de modo que ficam entre o parágrafo anterior e o seguinte.
+    Cada elemento é descartado assim que processado.
+
+    Se trechos for uma deque, recebe os trechos_paragrafo de cada parágrafo
+    (com enfases_estilos) antes que seu texto seja gerado.
+    """
+    eventos = etree.iterparse(stream, events=('end',), tag=(W_P, W_TBL), huge_tree=True)
+    # Usar as classes do python-docx para que .text siga as mesmas regras do modo padrão
+    eventos.set_element_class_lookup(element_class_lookup)
+
+    for _, elemento in eventos:
+        corpo = elemento.getparent()
+        if corpo is None or corpo.tag != W_BODY:
+            continue  # Parágrafos dentro de tabelas são tratados com a tabela
+
+        if elemento.tag == W_P:
+            if trechos is not None:
+                trechos.append(trechos_paragrafo(elemento, enfases_estilos))
+                yield texto_trechos(trechos[-1])
+            else:
+                yield elemento.text
+        else:
+            destino.write(xml_tabela(elemento, modelo))
+            # Adicionar espaço após tabela
+            destino.write(b'<w:p/>')
+
+        # Liberar o elemento processado e tudo o que veio antes dele
+        elemento.clear()
+        while elemento.getprevious() is not None:
+            del corpo[0]
+
+
+def _contar_memo(instrumentacao, memo, contagem_inicial):
+    # Consultas à memória de parágrafos feitas pela formatação: reaproveitadas ou calculadas
+    acertos, falhas = memo.contagem()
+    instrumentacao.contar('memo_reaproveitados', acertos - contagem_inicial[0])
+    instrumentacao.contar('memo_calculados', falhas - contagem_inicial[1])
+
+
+class Formatador:
+    """
+    Núcleo de formatação reentrante, para servidores com várias threads.
+
+    Toda a configuração é resolvida na criação: o papel timbrado (logo,
+    RODAPE_CONFIG, FORMATO_CONFIG e estilos, já serializado), o conjunto de
+    regras e o backend de parágrafos. O objeto é imutável e alterações
+    posteriores nos dicionários de configuração não o afetam, de modo que o
+    mesmo Formatador pode formatar vários documentos ao mesmo tempo, em
+    threads diferentes, com o mesmo resultado de uma execução em série.
+    O único estado compartilhado entre as chamadas é memo (por padrão, um
+    MemoParagrafos próprio), protegido por trava.
+    """
+
+    __slots__ = ('logo_path', 'regras_path', 'preservar_runs', 'modelo', 'regras', 'memo', 'criar_elemento')
+
+    def __init__(self, logo_path=None, regras_path=None, preservar_runs=False, memo=None, backend_paragrafos=None):
+        definir = super().__setattr__
+        definir('logo_path', logo_path)
+        definir('regras_path', regras_path)
+        definir('preservar_runs', preservar_runs)
+        definir('modelo', obter_modelo_timbrado(logo_path, regras_path))
+        definir('regras', obter_regras(regras_path))
+        definir('memo', memo if memo is not None else MemoParagrafos())
+        definir('criar_elemento',
+                BACKENDS_PARAGRAFO[backend_paragrafos or PROCESSAMENTO_CONFIG['backend_paragrafos']])
+
+    def __setattr__(self, nome, valor):
+        raise AttributeError("Formatador é imutável; crie outro com a nova configuração")
+
+    def formatar(self, doc_entrada, doc_saida=None, debug_mode=False, instrumentacao=None):
+        """Formata um documento; argumentos e retorno como em formatar_documento."""
+        memo = self.memo
+        modelo = self.modelo
+        contagem_inicial = memo.contagem()
+        if doc_saida is None:
+            doc_saida = io.BytesIO()
+
+        with etapa(instrumentacao, 'abrir_entrada'):
+            if not isinstance(doc_entrada, DocumentoDocx):
+                doc_entrada = Document(doc_entrada)
+
+        # Lista para armazenar informações de depuração
+        debug_info = []
+
+        # Criar novo documento a partir do papel timbrado (margens, cabeçalho e rodapé)
+        with etapa(instrumentacao, 'novo_documento'):
+            doc_novo = modelo.novo_documento()
+        # Ids dos estilos por tipo, resolvidos no modelo (a atribuição via Paragraph.style
+        # percorre todos os estilos do documento a cada parágrafo)
+        estilos = modelo.estilos
+
+        # Percorrer o corpo do documento original uma única vez, na ordem em que
+        # parágrafos e tabelas aparecem, e classificar todos os parágrafos
+        with etapa(instrumentacao, 'classificacao'):
+            blocos = list(blocos_do_corpo(doc_entrada))
+            if self.preservar_runs:
+                enfases_estilos = enfases_estilos_caractere(doc_entrada.styles.element)
+                trechos = [trechos_paragrafo(bloco, enfases_estilos) for bloco in blocos if bloco.tag == W_P]
+                textos = [texto_trechos(t) for t in trechos]
+            else:
+                trechos = None
+                textos = [bloco.text for bloco in blocos if bloco.tag == W_P]
+            classificados = classificar_paragrafos_lote(textos, debug_info if debug_mode else None, memo,
+                                                        self.regras)
+
+        # Parágrafos e tabelas entram diretamente antes do sectPr final do corpo
+        with etapa(instrumentacao, 'corpo'):
+            fim_do_corpo = doc_novo.element.body.sectPr
+            paragrafos = iter(classificados)
+            trechos = iter(trechos) if trechos is not None else None
+            for bloco in blocos:
+                if bloco.tag == W_TBL:
+                    # Tabelas ficam na posição original, seguidas de um espaço
+                    with etapa(instrumentacao, 'tabelas'):
+                        fim_do_corpo.addprevious(copiar_tabela(bloco, modelo))
+                        fim_do_corpo.addprevious(OxmlElement('w:p'))
+                    continue
+
+                texto, tipo = next(paragrafos)
+                trechos_texto = next(trechos) if trechos is not None else None
+                if tipo is None:  # Pular parágrafos vazios mas adicionar espaço
+                    fim_do_corpo.addprevious(OxmlElement('w:p'))
+                    continue
+
+                # Criar novo parágrafo com o estilo do tipo detectado; tipos sem estilo
+                # próprio (e o texto corrido dos pedidos) usam o estilo normal
+                estilo_id = estilos.get(tipo, estilos['normal'])
+                if trechos_texto is not None:
+                    fim_do_corpo.addprevious(memo.elemento_runs(trechos_texto, estilo_id, self.criar_elemento))
+                else:
+                    fim_do_corpo.addprevious(memo.elemento(texto, estilo_id, self.criar_elemento))
+
+        # Salvar documento
+        with etapa(instrumentacao, 'salvar'):
+            doc_novo.save(doc_saida)
+
+        if instrumentacao is not None:
+            instrumentacao.documentos += 1
+            instrumentacao.contar_tipos(tipo or 'vazio' for _, tipo in classificados)
+            _contar_memo(instrumentacao, memo, contagem_inicial)
+
+        if debug_mode:
+            return doc_saida, debug_info
+        else:
+            return doc_saida
+
+    def formatar_streaming(self, entrada, saida=None, debug_mode=False, instrumentacao=None):
+        """Formata um documento no modo streaming; argumentos e retorno como em formatar_documento_streaming."""
+        memo = self.memo
+        modelo = self.modelo
+        contagem_inicial = memo.contagem()
+        if saida is None:
+            saida = io.BytesIO()
+
+        debug_info = []
+        tipos = Counter() if instrumentacao is not None else None
+        estilos = modelo.estilos
+
+        with zipfile.ZipFile(io.BytesIO(modelo.dados)) as zip_modelo, \
+             zipfile.ZipFile(entrada) as zip_entrada, \
+             zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as zip_saida:
+
+            # O corpo do modelo só contém o sectPr; o conteúdo entra antes dele
+            xml_modelo = zip_modelo.read('word/document.xml')
+            inicio_corpo = xml_modelo.index(b'<w:body>') + len(b'<w:body>')
+            inicio_sectpr = xml_modelo.rindex(b'<w:sectPr')
+
+            for info in zip_modelo.infolist():
+                if info.filename != 'word/document.xml':
+                    with etapa(instrumentacao, 'copiar_partes'):
+                        zip_saida.writestr(info, zip_modelo.read(info.filename))
+                    continue
+
+                with etapa(instrumentacao, 'corpo_streaming'), \
+                     zip_saida.open(info.filename, 'w') as destino, \
+                     zip_entrada.open('word/document.xml') as origem:
+                    destino.write(xml_modelo[:inicio_corpo])
+
+                    trechos = deque() if self.preservar_runs else None
+                    enfases_estilos = None
+                    if self.preservar_runs and 'word/styles.xml' in zip_entrada.namelist():
+                        enfases_estilos = enfases_estilos_caractere(
+                            etree.fromstring(zip_entrada.read('word/styles.xml')))
+                    textos = _iterar_corpo(origem, destino, modelo, trechos, enfases_estilos)
+                    classificados = classificar_paragrafos(textos, debug_info if debug_mode else None, memo,
+                                                           self.regras)
+                    for texto, tipo in classificados:
+                        trechos_texto = trechos.popleft() if trechos is not None else None
+                        if tipos is not None:
+                            tipos[tipo or 'vazio'] += 1
+                        if tipo is None:  # Parágrafo vazio mantido como espaço
+                            destino.write(b'<w:p/>')
+                        elif trechos_texto is not None:
+                            destino.write(memo.xml_runs(trechos_texto, estilos.get(tipo, estilos['normal'])))
+                        else:
+                            destino.write(memo.xml(texto, estilos.get(tipo, estilos['normal'])))
+
+                    destino.write(xml_modelo[inicio_sectpr:])
+
+        if instrumentacao is not None:
+            instrumentacao.documentos += 1
+            instrumentacao.contar_tipos(tipos)
+            _contar_memo(instrumentacao, memo, contagem_inicial)
+
+        if debug_mode:
+            return saida, debug_info
+        else:
+            return saida
+
+
+def formatar_documento_streaming(entrada, saida=None, logo_path=None, debug_mode=False, memo=None,
+                                 instrumentacao=None, preservar_runs=False, regras_path=None):
+    """
+    Formata um documento lendo e escrevendo o corpo de forma incremental.
+
+    O word/document.xml da entrada é lido com iterparse, e cada parágrafo é
+    classificado, gravado na saída e descartado em seguida, de modo que o pico
+    de memória não cresce com o tamanho do documento.
+
+    entrada e saida aceitam caminhos ou objetos de arquivo; se saida for omitida,
+    o documento é gravado em um BytesIO. Retorna o mesmo que formatar_documento,
+    e preservar_runs e regras_path têm o mesmo efeito.
+    Como leitura, classificação e escrita são intercaladas, a instrumentação
+    registra o corpo como uma única etapa.
+    """
+    with etapa(instrumentacao, 'modelo_timbrado'):
+        formatador = Formatador(logo_path, regras_path, preservar_runs, memo or MEMO_PARAGRAFOS)
+    return formatador.formatar_streaming(entrada, saida, debug_mode, instrumentacao)
@@ -0,0 +1,495 @@
+"""
+Fila de trabalhos de formatação executados em segundo plano.
+
+Cada lote enviado vira um Trabalho com um identificador; a interface guarda só
+o identificador e consulta o progresso, de modo que a página não fica presa
+durante a formatação e os resultados sobrevivem às novas execuções do script.
+Todos os trabalhos compartilham um único pool de processos com um limite global,
+e os documentos dos lotes ativos são despachados alternadamente (um de cada lote
+por vez), para que um lote grande não faça os outros usuários esperarem por ele.
+"""
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from depuracao import AnaliseDepuracao
+from formatador import (PROCESSAMENTO_CONFIG, ArquivoZip, LeitorArquivo, _executar_isolado, chave_resultado,
+                        criar_arquivo_zip, formatar_arquivo, nome_formatado, preparar_processo)
+from instrumentacao import Instrumentacao, etapa
+from logo import marcar_uso_logo
+
+# Configurações da fila de trabalhos
+FILA_CONFIG = {
+    # Máximo de documentos formatados ao mesmo tempo no servidor, somando todos os usuários
+    'limite_global': int(os.environ.get('FORMATADOR_LIMITE_GLOBAL', PROCESSAMENTO_CONFIG['max_workers'])),
+    'retencao': 60 * 60,  # Segundos que um trabalho concluído fica disponível para download
+    # Bytes retidos somando todos os trabalhos; acima disso, os concluídos há mais tempo são descartados
+    'memoria_maxima': int(os.environ.get('FORMATADOR_MEMORIA_MAXIMA', 1024 * 1024 * 1024)),
+    'intervalo_limpeza': 60  # Segundos entre as verificações de trabalhos expirados
+}
+
+# Estados de um trabalho
+NA_FILA = 'na_fila'
+PROCESSANDO = 'processando'
+CONCLUIDO = 'concluido'
+CANCELADO = 'cancelado'
+
+
+class Trabalho:
+    """
+    Um lote de documentos enviado à fila. Os atributos são atualizados pela
+    thread da fila; a interface só os lê.
+
+    resultados guarda (nome_saida, dados_saida) na ordem de envio, com None para
+    os documentos ainda não formatados ou com erro; debug_infos e erros são
+    preenchidos à medida que os documentos terminam. Com gerar_zip, cada
+    documento vai para o ZIP do lote assim que fica pronto, inclusive os que
+    terminam depois de um cancelamento, e só fica lá: dados_saida é None e
+    dados_arquivo o lê de volta do ZIP. Só os que terminam depois de o ZIP ser
+    fechado (ver arquivo_zip) ficam em resultados.
+    tamanho estima os bytes retidos pelo trabalho: entradas ainda não
+    formatadas, saídas (no ZIP ou em resultados) e análises de depuração.
+    Arquivos com conteúdo idêntico a outro do lote não são formatados de novo:
+    recebem o resultado (ou o erro) do primeiro, e duplicados conta quantos.
+    Com preservar_runs, a ênfase do texto original é mantida, e com regras_path
+    valem os tipos e estilos do arquivo de regras (ver formatar_documento).
+    """
+
+    def __init__(self, arquivos, logo_path=None, debug_mode=False, max_processos=None, cache=None,
+                 instrumentacao=None, gerar_zip=True, preservar_runs=False, regras_path=None):
+        self.id = uuid.uuid4().hex
+        self.nomes = [nome for nome, _ in arquivos]
+        self.total = len(arquivos)
+        self.logo_path = logo_path
+        self.debug_mode = debug_mode
+        self.preservar_runs = preservar_runs
+        self.regras_path = regras_path
+        self.max_processos = max_processos or FILA_CONFIG['limite_global']
+        self.cache = cache
+        self.instrumentacao = instrumentacao
+        self.instrumentacao_docs = Instrumentacao() if instrumentacao is not None else None
+
+        self.estado = NA_FILA
+        self.resultados = [None] * self.total
+        self.debug_infos = {}
+        self._analises = {}
+        self.erros = []
+        self.concluidos = 0
+        self.reaproveitados = 0
+        self.duplicados = 0
+        self.criado_em = time.time()
+        self.concluido_em = None
+        self._tamanho_entradas = sum(len(dados) for _, dados in arquivos)
+        self.tamanho = self._tamanho_entradas
+
+        # Estado de despacho, usado só pela thread da fila
+        self._arquivos = arquivos
+        self._pendentes = deque()
+        self._copias = {}  # Índice formatado -> índices dos arquivos idênticos a ele
+        primeiros = {}
+        for i, (_, dados) in enumerate(arquivos):
+            primeiro = primeiros.setdefault(dados, i)
+            if primeiro == i:
+                self._pendentes.append(i)
+            else:
+                self._copias.setdefault(primeiro, []).append(i)
+                self.duplicados += 1
+        if instrumentacao is not None:
+            instrumentacao.contar('arquivos_duplicados', self.duplicados)
+        self._chaves = {}
+        self._em_execucao = {}
+        self._inicio = time.perf_counter()
+        self._ordem = []  # Índices na ordem em que terminaram
+        self._condicao = threading.Condition()
+        self._pronto = threading.Event()
+        self._zip = ArquivoZip() if gerar_zip and self.total > 1 else None
+        self._posicoes_zip = {}  # Índice -> posição do documento no ZIP
+
+    @property
+    def concluido(self):
+        return self.estado in (CONCLUIDO, CANCELADO)
+
+    @property
+    def progresso(self):
+        return self.concluidos / self.total if self.total else 1.0
+
+    def aguardar(self, timeout=None):
+        """Bloqueia até o trabalho terminar; retorna False se o tempo acabar antes."""
+        return self._pronto.wait(timeout)
+
+    def processados(self):
+        """Índices dos documentos formatados, na ordem de envio."""
+        return [i for i, r in enumerate(self.resultados) if r is not None]
+
+    @property
+    def quantidade_zip(self):
+        """Número de documentos no ZIP retornado por arquivo_zip."""
+        if self._zip is None:
+            return len(self.processados())
+        return self._zip.quantidade
+
+    def dados_arquivo(self, i):
+        """Conteúdo do documento formatado i; deve ser chamado após o fim do trabalho."""
+        dados_saida = self.resultados[i][1]
+        if dados_saida is None:
+            with self._condicao:
+                self._zip.fechar()
+            dados_saida = self._zip.ler(self._posicoes_zip[i])
+        return dados_saida
+
+    def analise_depuracao(self, i):
+        """AnaliseDepuracao do documento i, criada na primeira consulta, ou None sem debug_info."""
+        if i not in self.debug_infos:
+            return None
+        if i not in self._analises:
+            self._analises[i] = AnaliseDepuracao(self.debug_infos[i])
+        return self._analises[i]
+
+    def acompanhar(self, timeout=None):
+        """
+        Gera o índice de cada documento à medida que termina (formatado ou com
+        erro), até o fim do trabalho. Lança TimeoutError se timeout segundos
+        se passarem sem que o trabalho termine.
+        """
+        prazo = None if timeout is None else time.monotonic() + timeout
+        entregues = 0
+        while True:
+            with self._condicao:
+                while entregues == len(self._ordem) and not self.concluido:
+                    restante = None if prazo is None else prazo - time.monotonic()
+                    if restante is not None and restante <= 0:
+                        raise TimeoutError("Tempo máximo de formatação excedido")
+                    self._condicao.wait(restante)
+                novos = self._ordem[entregues:]
+                fim = self.concluido
+            yield from novos
+            entregues += len(novos)
+            if fim:
+                return
+
+    def arquivo_zip(self):
+        """
+        ZIP com os documentos formatados, como um arquivo aberto posicionado no
+        início; deve ser chamado após o fim do trabalho. O ZIP do lote é fechado
+        na primeira chamada e devolvido sem cópia para a memória.
+        """
+        if self._zip is None:
+            return criar_arquivo_zip([(self.resultados[i][0], self.dados_arquivo(i))
+                                      for i in self.processados()])
+        with self._condicao:
+            return LeitorArquivo(self._zip.fechar())
+
+    def _registrar(self, i, resultado, erro):
+        copias = self._copias.pop(i, ())
+        if erro is not None:
+            for j in (i, *copias):
+                self.erros.append((self.nomes[j], erro))
+        else:
+            _, dados_saida, debug_info, relatorio = resultado
+            guardados = False
+            for j in (i, *copias):
+                # As cópias compartilham os bytes da saída e o debug_info do primeiro
+                nome_saida = nome_formatado(self.nomes[j])
+                with self._condicao:
+                    no_zip = self._zip is not None and not self._zip.fechado
+                    if no_zip:
+                        with etapa(self.instrumentacao, 'zip'):
+                            self._posicoes_zip[j] = self._zip.adicionar(nome_saida, dados_saida)
+                if no_zip:
+                    self.resultados[j] = (nome_saida, None)
+                    self.tamanho += len(dados_saida)  # Os .docx vão sem compressão para o ZIP
+                else:
+                    self.resultados[j] = (nome_saida, dados_saida)
+                    guardados = True
+                if self.debug_mode:
+                    self.debug_infos[j] = debug_info
+            if guardados:
+                self.tamanho += len(dados_saida)
+            if self.debug_mode:
+                self.tamanho += len(json.dumps(debug_info))
+            if relatorio is not None and self.instrumentacao_docs is not None:
+                self.instrumentacao_docs.mesclar(relatorio)
+        with self._condicao:
+            self.concluidos += 1 + len(copias)
+            self._ordem.append(i)
+            self._ordem.extend(copias)
+            self._condicao.notify_all()
+
+    def _finalizar(self, estado=CONCLUIDO):
+        self.estado = estado
+        self.concluido_em = time.time()
+        self._arquivos = None  # As entradas não são mais necessárias
+        self.tamanho -= self._tamanho_entradas
+        self._pendentes.clear()
+        if self.instrumentacao is not None:
+            self.instrumentacao.registrar('formatacao', time.perf_counter() - self._inicio)
+        with self._condicao:
+            self._condicao.notify_all()
+        self._pronto.set()
+
+
+class FilaTrabalhos:
+    """
+    Executa trabalhos de formatação em um pool de processos compartilhado, com
+    no máximo limite documentos em andamento ao mesmo tempo e no máximo
+    trabalho.max_processos documentos de um mesmo trabalho.
+
+    Uma única thread despacha as tarefas e recolhe os resultados; submeter,
+    obter, cancelar e remover podem ser chamados de qualquer thread.
+
+    Com logo_path, cada processo carrega o papel timbrado desse logo ao iniciar,
+    e os trabalhos com o mesmo logo não pagam esse custo.
+
+    Trabalhos concluídos são descartados após retencao segundos ou, se a soma
+    de Trabalho.tamanho passar de memoria_maxima, a partir dos concluídos há
+    mais tempo. Trabalhos em andamento e o concluído mais recentemente nunca
+    são descartados.
+    """
+
+    def __init__(self, limite=None, retencao=None, logo_path=None, memoria_maxima=None):
+        self.limite = max(1, limite or FILA_CONFIG['limite_global'])
+        self.retencao = retencao if retencao is not None else FILA_CONFIG['retencao']
+        self.memoria_maxima = memoria_maxima or FILA_CONFIG['memoria_maxima']
+        self.logo_path = logo_path
+        self._trabalhos = {}
+        self._trava = threading.Lock()
+        self._eventos = queue.Queue()
+        self._ativos = deque()
+        self._em_execucao = 0
+        self._executor = None
+        self._aquecido = threading.Event()
+        self._thread = threading.Thread(target=self._despachar, name='fila-formatacao', daemon=True)
+        self._thread.start()
+
+    def submeter(self, arquivos, logo_path=None, debug_mode=False, max_processos=None, cache=None,
+                 instrumentacao=None, gerar_zip=True, preservar_runs=False, regras_path=None):
+        """
+        Enfileira um lote de tuplas (nome, dados) e retorna o identificador do
+        trabalho. Com um CacheResultados, documentos já formatados são devolvidos
+        dele e os novos resultados são guardados nele, como em formatar_lote.
+        """
+        self._remover_expirados()
+        trabalho = Trabalho(arquivos, logo_path, debug_mode, max_processos, cache, instrumentacao, gerar_zip,
+                            preservar_runs, regras_path)
+        with self._trava:
+            self._trabalhos[trabalho.id] = trabalho
+        self._eventos.put(('novo', trabalho))
+        return trabalho.id
+
+    def obter(self, trabalho_id):
+        """Retorna o Trabalho com o identificador, ou None se não existir ou já tiver expirado."""
+        with self._trava:
+            return self._trabalhos.get(trabalho_id)
+
+    def cancelar(self, trabalho_id):
+        """Descarta os documentos ainda não iniciados do trabalho; os em andamento terminam normalmente."""
+        trabalho = self.obter(trabalho_id)
+        if trabalho is not None and not trabalho.concluido:
+            self._eventos.put(('cancelar', trabalho))
+
+    def remover(self, trabalho_id):
+        """Cancela o trabalho, se necessário, e libera seus resultados."""
+        self.cancelar(trabalho_id)
+        with self._trava:
+            self._trabalhos.pop(trabalho_id, None)
+
+    def estatisticas(self):
+        """
+        Retorna o número de trabalhos guardados e dos aguardando ou em andamento,
+        de documentos em execução e os bytes retidos por todos os trabalhos.
+        """
+        with self._trava:
+            trabalhos = list(self._trabalhos.values())
+        return {
+            'trabalhos': len(trabalhos),
+            'trabalhos_ativos': sum(1 for t in trabalhos if not t.concluido),
+            'em_execucao': self._em_execucao,
+            'limite': self.limite,
+            'memoria': sum(t.tamanho for t in trabalhos),
+            'memoria_maxima': self.memoria_maxima,
+        }
+
+    def aquecer(self):
+        """Inicia todos os processos do pool agora, em vez de na primeira formatação."""
+        self._eventos.put(('aquecer', None))
+        self._aquecido.wait()
+
+    def encerrar(self):
+        """Para a thread da fila e o pool de processos."""
+        self._eventos.put(None)
+        self._thread.join()
+
+    def _remover_expirados(self):
+        limite = time.time() - self.retencao
+        with self._trava:
+            expirados = [i for i, t in self._trabalhos.items()
+                         if t.concluido and t.concluido_em < limite]
+            for trabalho_id in expirados:
+                del self._trabalhos[trabalho_id]
+
+            # Acima do limite de memória, descartar os concluídos há mais tempo
+            total = sum(t.tamanho for t in self._trabalhos.values())
+            if total > self.memoria_maxima:
+                concluidos = sorted((t for t in self._trabalhos.values() if t.concluido),
+                                    key=lambda t: t.concluido_em)
+                for trabalho in concluidos[:-1]:  # O último concluído ainda não foi baixado
+                    if total <= self.memoria_maxima:
+                        break
+                    del self._trabalhos[trabalho.id]
+                    total -= trabalho.tamanho
+
+    def _obter_executor(self):
+        if self._executor is None:
+            contexto = multiprocessing.get_context(PROCESSAMENTO_CONFIG['metodo_inicio'])
+            self._executor = ProcessPoolExecutor(max_workers=self.limite, mp_context=contexto,
+                                                 initializer=preparar_processo,
+                                                 initargs=(self.logo_path,))
+        return self._executor
+
+    def _despachar(self):
+        while True:
+            try:
+                evento = self._eventos.get(timeout=FILA_CONFIG['intervalo_limpeza'])
+            except queue.Empty:
+                # Sem atividade: descartar os trabalhos que as sessões abandonaram
+                self._remover_expirados()
+                continue
+            if evento is None:
+                break
+            tipo, trabalho = evento[:2]
+            try:
+                if tipo == 'novo':
+                    self._iniciar(trabalho)
+                elif tipo == 'resultado':
+                    self._concluir_tarefa(trabalho, *evento[2:])
+                elif tipo == 'cancelar':
+                    self._cancelar(trabalho)
+                elif tipo == 'aquecer':
+                    self._aquecer()
+            except Exception as e:
+                # Um erro inesperado encerra o trabalho, mas não a fila
+                if trabalho is not None:
+                    self._falhar(trabalho, str(e))
+            self._preencher()
+
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+
+    def _aquecer(self):
+        # Tarefas simultâneas fazem o pool criar todos os processos, cada um
+        # executando o inicializador
+        executor = self._obter_executor()
+        try:
+            for futuro in [executor.submit(os.getpid) for _ in range(self.limite)]:
+                futuro.result()
+        finally:
+            self._aquecido.set()
+
+    def _iniciar(self, trabalho):
+        """Devolve do cache o que já foi formatado e coloca o restante na rodada."""
+        trabalho.estado = PROCESSANDO
+        if trabalho.logo_path:
+            marcar_uso_logo(trabalho.logo_path)  # Protege o logo de limpar_logos enquanto o trabalho roda
+        if trabalho.cache is not None:
+            pendentes = deque()
+            for i in trabalho._pendentes:
+                nome, dados = trabalho._arquivos[i]
+                try:
+                    trabalho._chaves[i] = chave_resultado(dados, trabalho.logo_path,
+                                                          preservar_runs=trabalho.preservar_runs,
+                                                          regras_path=trabalho.regras_path)
+                    encontrado = trabalho.cache.obter(trabalho._chaves[i], trabalho.debug_mode)
+                except (OSError, ValueError):
+                    encontrado = None  # Ex.: logo ou regras ilegíveis; a formatação reporta o erro
+                if encontrado is None:
+                    pendentes.append(i)
+                    continue
+                dados_saida, debug_info = encontrado
+                trabalho._registrar(i, (nome_formatado(nome), dados_saida, debug_info, None), None)
+                trabalho.reaproveitados += 1
+            trabalho._pendentes = pendentes
+
+        if trabalho._pendentes:
+            self._ativos.append(trabalho)
+        else:
+            trabalho._finalizar()
+
+    def _preencher(self):
+        """Envia tarefas ao pool até o limite global, uma de cada trabalho ativo por vez."""
+        tentativas = len(self._ativos)
+        while self._em_execucao < self.limite and self._ativos and tentativas > 0:
+            trabalho = self._ativos.popleft()
+            if trabalho.concluido or not trabalho._pendentes:
+                tentativas = len(self._ativos)
+                continue
+            if len(trabalho._em_execucao) >= trabalho.max_processos:
+                # Trabalho no seu próprio limite: passa a vez
+                self._ativos.append(trabalho)
+                tentativas -= 1
+                continue
+
+            self._enviar(trabalho, trabalho._pendentes.popleft())
+            if trabalho._pendentes:
+                self._ativos.append(trabalho)
+            tentativas = len(self._ativos)
+
+    def _enviar(self, trabalho, i):
+        nome, dados = trabalho._arquivos[i]
+        args = (nome, dados, trabalho.logo_path, trabalho.debug_mode, None,
+                trabalho.instrumentacao is not None, trabalho.preservar_runs, trabalho.regras_path)
+        if trabalho.instrumentacao is not None and 'espera_fila' not in trabalho.instrumentacao.duracoes:
+            trabalho.instrumentacao.registrar('espera_fila', time.perf_counter() - trabalho._inicio)
+        try:
+            futuro = self._obter_executor().submit(_executar_isolado, formatar_arquivo, args)
+        except BrokenProcessPool:
+            # Um processo morreu (ex.: falta de memória); recriar o pool para os próximos
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            futuro = self._obter_executor().submit(_executar_isolado, formatar_arquivo, args)
+        except Exception as e:
+            trabalho._registrar(i, None, str(e))
+            if not trabalho._pendentes and not trabalho._em_execucao:
+                trabalho._finalizar()
+            return
+
+        trabalho._em_execucao[i] = futuro
+        self._em_execucao += 1
+        futuro.add_done_callback(lambda f: self._eventos.put(('resultado', trabalho, i, f)))
+
+    def _concluir_tarefa(self, trabalho, i, futuro):
+        self._em_execucao -= 1
+        del trabalho._em_execucao[i]
+        if futuro.cancelled():
+            return
+        try:
+            resultado, erro = futuro.result()
+        except Exception as e:  # Falha do próprio processo de trabalho
+            resultado, erro = None, str(e) or type(e).__name__
+
+        if erro is None and i in trabalho._chaves:
+            try:
+                trabalho.cache.guardar(trabalho._chaves[i], resultado[1], resultado[2])
+            except OSError:
+                pass  # O cache é só uma otimização; falhas de disco não afetam o lote
+        trabalho._registrar(i, resultado, erro)
+
+        if not trabalho.concluido and not trabalho._pendentes and not trabalho._em_execucao:
+            trabalho._finalizar()
+            self._remover_expirados()
+
+    def _cancelar(self, trabalho):
+        for futuro in trabalho._em_execucao.values():
+            futuro.cancel()
+        trabalho._finalizar(CANCELADO)
+
+    def _falhar(self, trabalho, erro):
+        for i in trabalho._pendentes:
+            trabalho._registrar(i, None, erro)
+        trabalho._finalizar()
@@ -0,0 +1,696 @@
+"""
+Núcleo do formatador: configurações, classificação dos parágrafos, chaves de
+cache, ZIPs e execução em lote. Importa só a biblioteca padrão e os módulos
+leves do projeto.
+
+A construção dos documentos com o python-docx fica em documento.py, importado
+na primeira formatação; os nomes de lá (Formatador, formatar_documento,
+ModeloTimbrado etc.) continuam acessíveis por este módulo.
+"""
+import copy
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+
+from instrumentacao import Instrumentacao
+from logo import LOGO_CONFIG
+from regras import REGRAS, obter_regras
+
+# Configurações do rodapé
+RODAPE_CONFIG = {
+    'endereco': 'Avenida Cristovão Colombo, nº 485, 4º andar, Savassi, Belo Horizonte/MG',
+    'telefone': '(31) 9 9703-9242',
+    'email': 'contato@icaadvocacia.com.br',
+    'cor_fundo': (0, 0, 102),  # RGB para azul escuro (navy)
+    'cor_texto': (255, 255, 255),  # RGB para branco
+    'largura': '150%',  # Define a largura do rodapé como 100% da página
+    'altura': '150%'
+}
+
+# Configurações de formatação
+FORMATO_CONFIG = {
+    'fonte_padrao': 'Arial',
+    'tamanho_fonte_normal': 12,
+    'tamanho_fonte_titulo': 12,
+    'cor_titulo': (59, 75, 160),  # RGB para azul ICA (#3B4BA0)
+    'cor_secao': (59, 75, 160),  # RGB para azul ICA
+    'cor_linha': (192, 192, 192),  # RGB para cinza claro
+    'espacamento_antes': 76200,  # Pt(6), em EMU
+    'espacamento_depois': 76200,
+    'espacamento_linha': 1.5
+}
+
+# Estilos de parágrafo por tipo detectado. São criados uma única vez no papel
+# timbrado e referenciados pelos parágrafos, em vez de formatação direta.
+# Parâmetros omitidos usam os padrões de criar_estilo_paragrafo.
+ESTILOS_CONFIG = {
+    'cabecalho': {
+        'nome': 'ICA Cabeçalho', 'alinhamento': 'center', 'negrito': True,
+        'espacamento_antes': 0, 'espacamento_depois': 40, 'recuo_primeira_linha': False
+    },
+    'titulo_acao': {
+        'nome': 'ICA Título da Ação', 'alinhamento': 'center', 'negrito': True,
+        'espacamento_antes': 30, 'espacamento_depois': 24,
+        'cor_texto': FORMATO_CONFIG['cor_titulo'], 'recuo_primeira_linha': False
+    },
+    'secao_principal': {
+        'nome': 'ICA Seção Principal', 'alinhamento': 'left', 'negrito': True,
+        'espacamento_antes': 12, 'espacamento_depois': 6,
+        'cor_texto': FORMATO_CONFIG['cor_secao'], 'recuo_primeira_linha': False,
+        'linha_horizontal': True
+    },
+    'item_doc': {
+        'nome': 'ICA Item Doc', 'alinhamento': 'left', 'recuo_lista': True
+    },
+    'subsecao': {
+        'nome': 'ICA Subseção', 'alinhamento': 'left', 'negrito': True, 'recuo_lista': True
+    },
+    'citacao': {
+        'nome': 'ICA Citação', 'alinhamento': 'justify', 'italico': True,
+        'tamanho_fonte': 11, 'recuo_lista': True  # Fonte menor, itálico e com recuo
+    },
+    'lista': {
+        'nome': 'ICA Lista', 'alinhamento': 'left',
+        'espacamento_antes': 3, 'espacamento_depois': 3, 'recuo_lista': True
+    },
+    'secao_pedidos': {
+        'nome': 'ICA Seção de Pedidos', 'alinhamento': 'center', 'negrito': True,
+        'espacamento_antes': 24, 'espacamento_depois': 12, 'recuo_primeira_linha': False,
+        'linha_horizontal': True
+    },
+    'item_pedido': {
+        'nome': 'ICA Item de Pedido', 'alinhamento': 'justify', 'recuo_lista': True
+    },
+    # Parágrafos normais, inclusive os de texto corrido dentro dos pedidos
+    'normal': {
+        'nome': 'ICA Normal', 'alinhamento': 'justify'
+    },
+}
+
+# Configurações de processamento em lote
+PROCESSAMENTO_CONFIG = {
+    'max_workers': os.cpu_count() or 1,  # Número de processos paralelos
+    'metodo_inicio': 'spawn',  # Evita fork de um servidor com várias threads
+    'limite_streaming': 8 * 1024 * 1024,  # Acima deste tamanho (bytes), usa o modo streaming
+    'limite_zip_memoria': 64 * 1024 * 1024,  # Acima deste tamanho (bytes), o ZIP do lote vai para o disco
+    'backend_paragrafos': 'lxml'  # Construção dos parágrafos: 'lxml' (direto) ou 'python-docx'
+}
+
+# Nomes definidos em documento.py, que dependem do python-docx
+_NOMES_DOCUMENTO = frozenset({
+    'ALINHAMENTOS', 'BACKENDS_PARAGRAFO', 'MOLDURA_RODAPE_XML', 'Formatador', 'ModeloTimbrado',
+    'adicionar_linha_horizontal', 'aplicar_formatacao_paragrafo', 'blocos_do_corpo', 'copiar_tabela',
+    'cor_hex', 'criar_cabecalho', 'criar_elemento_paragrafo', 'criar_estilo_paragrafo', 'criar_estilos',
+    'criar_rodape', 'elemento_paragrafo', 'elemento_paragrafo_lxml', 'elemento_paragrafo_runs', 'enfase_run',
+    'enfases_estilos_caractere', 'formatar_documento', 'formatar_documento_streaming', 'fragmento_xml',
+    'obter_modelo_timbrado', 'texto_trechos', 'trechos_paragrafo', 'verificar_estilos', 'xml_paragrafo',
+    'xml_paragrafo_runs', 'xml_tabela',
+})
+
+
+def _documento():
+    import documento
+    return documento
+
+
+def __getattr__(nome):
+    # O python-docx só é importado quando um nome de documento.py é usado
+    if nome in _NOMES_DOCUMENTO:
+        return getattr(_documento(), nome)
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
+
+
+def estilos_regras(regras=None):
+    """Estilos por tipo de ESTILOS_CONFIG, sobrepostos pelos do ConjuntoRegras."""
+    if regras is None or not regras.estilos:
+        return ESTILOS_CONFIG
+    return {**ESTILOS_CONFIG, **regras.estilos}
+
+
+# Classificador das regras padrão (ver regras.REGRAS_PADRAO)
+CLASSIFICADOR = REGRAS.classificador
+
+
+def detectar_tipo_paragrafo(texto, em_pedidos=False):
+    """
+    Detecta o tipo de parágrafo com base em características específicas.
+    Delega ao classificador pré-compilado, que verifica as regras em ordem de prioridade.
+    """
+    return CLASSIFICADOR.classificar(texto, em_pedidos)
+
+
+class MemoParagrafos:
+    """
+    Memória dos parágrafos já processados, para que uma nova versão de um
+    documento só reclassifique e reconstrua os parágrafos que mudaram.
+
+    Guarda a classificação por (regras, texto, em_pedidos) e o parágrafo pronto por
+    (texto, estilo), ou por (trechos, estilo) no modo preservar_runs, tanto
+    como elemento (modo padrão) quanto como XML serializado (modo streaming).
+    Os itens menos usados recentemente são descartados quando o limite é atingido.
+
+    Compartilhada entre os documentos de um lote, funciona como uma tabela de
+    textos já vistos: o texto padrão repetido entre petições (qualificação,
+    pedidos, listas de documentos) é classificado e montado uma única vez.
+    acertos e falhas somam todas as threads; contagem dá os da thread atual.
+    """
+
+    def __init__(self, max_itens=20000):
+        self.max_itens = max_itens
+        self.acertos = 0
+        self.falhas = 0
+        self._itens = OrderedDict()
+        self._trava = threading.Lock()
+        self._local = threading.local()
+
+    def _contar(self, acertos, falhas):
+        # Chamado com a trava adquirida
+        self.acertos += acertos
+        self.falhas += falhas
+        local = self._local
+        local.acertos = getattr(local, 'acertos', 0) + acertos
+        local.falhas = getattr(local, 'falhas', 0) + falhas
+
+    def contagem(self):
+        """
+        (acertos, falhas) da thread atual; a diferença entre duas chamadas mede o
+        trabalho reaproveitado por uma formatação, mesmo com outras em paralelo.
+        """
+        return getattr(self._local, 'acertos', 0), getattr(self._local, 'falhas', 0)
+
+    def _obter(self, chave, criar):
+        with self._trava:
+            valor = self._itens.get(chave)
+            if valor is not None:
+                self._itens.move_to_end(chave)
+                self._contar(1, 0)
+                return valor
+            self._contar(0, 1)
+
+        valor = criar()
+        with self._trava:
+            self._itens[chave] = valor
+            if len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+        return valor
+
+    def classificar(self, texto, em_pedidos=False, regras=None):
+        """
+        Mesmo retorno de detectar_tipo_paragrafo (ou do classificador do
+        ConjuntoRegras), reaproveitando classificações anteriores.
+        """
+        regras = regras or REGRAS
+        return self._obter(('tipo', regras.chave, texto, em_pedidos),
+                           lambda: regras.classificador.classificar(texto, em_pedidos))
+
+    def classificar_lote(self, textos, estados, regras=None):
+        """
+        Mesmo retorno de classificar_lote(textos, estados) do classificador das
+        regras (por padrão, CLASSIFICADOR), para textos já sem espaços nas
+        pontas, classificando em lote só os que não estão na memória.
+        """
+        regras = regras or REGRAS
+        resultados = [None] * len(textos)
+        faltando = []
+        novas = set()  # O classificador avalia uma única vez os textos repetidos no mesmo estado
+        acertos = 0
+        with self._trava:
+            for i, chave in enumerate(zip(textos, estados)):
+                if not chave[0]:
+                    continue
+                chave = ('tipo', regras.chave) + chave
+                valor = self._itens.get(chave)
+                if valor is not None:
+                    self._itens.move_to_end(chave)
+                    acertos += 1
+                    resultados[i] = valor
+                else:
+                    faltando.append(i)
+                    novas.add(chave)
+            self._contar(acertos + len(faltando) - len(novas), len(novas))
+
+        novos = regras.classificador.classificar_lote([textos[i] for i in faltando],
+                                                      [estados[i] for i in faltando])
+        with self._trava:
+            for i, valor in zip(faltando, novos):
+                resultados[i] = valor
+                self._itens[('tipo', regras.chave, textos[i], estados[i])] = valor
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+        return resultados
+
+    def elemento(self, texto, estilo_id, criar=None):
+        """
+        Retorna uma cópia nova do elemento w:p com o texto e o estilo informados,
+        criado por criar (uma função de BACKENDS_PARAGRAFO; por padrão, a do
+        backend configurado) quando ainda não estiver na memória.
+        """
+        criar = criar or _documento().criar_elemento_paragrafo
+        modelo = self._obter(('elemento', texto, estilo_id),
+                             lambda: criar(texto, estilo_id))
+        return copy.deepcopy(modelo)
+
+    def xml(self, texto, estilo_id):
+        """Retorna o XML serializado do parágrafo com o texto e o estilo informados."""
+        return self._obter(('xml', texto, estilo_id),
+                           lambda: _documento().xml_paragrafo(texto, estilo_id))
+
+    def elemento_runs(self, trechos, estilo_id, criar=None):
+        """Como elemento, para os trechos (texto, enfase) de trechos_paragrafo."""
+        if len(trechos) == 1 and not trechos[0][1]:
+            # Sem ênfase, o parágrafo é o mesmo do modo de um único run
+            return self.elemento(trechos[0][0], estilo_id, criar)
+        modelo = self._obter(('elemento_runs', trechos, estilo_id),
+                             lambda: _documento().elemento_paragrafo_runs(trechos, estilo_id))
+        return copy.deepcopy(modelo)
+
+    def xml_runs(self, trechos, estilo_id):
+        """Como xml, para os trechos (texto, enfase) de trechos_paragrafo."""
+        if len(trechos) == 1 and not trechos[0][1]:
+            return self.xml(trechos[0][0], estilo_id)
+        return self._obter(('xml_runs', trechos, estilo_id),
+                           lambda: _documento().xml_paragrafo_runs(trechos, estilo_id))
+
+    def limpar(self):
+        with self._trava:
+            self._itens.clear()
+
+
+# Memória usada por padrão por formatar_documento e formatar_documento_streaming
+MEMO_PARAGRAFOS = MemoParagrafos()
+
+
+def classificar_paragrafos(textos, debug_info=None, memo=None, regras=None):
+    """
+    Classifica uma sequência de textos de parágrafos, mantendo o estado da seção
+    de pedidos entre eles. Aceita qualquer iterável, inclusive geradores, e não
+    guarda os textos já processados.
+
+    Gera (texto, tipo) para cada parágrafo, com o texto sem espaços nas pontas e
+    tipo None nos parágrafos vazios. Se debug_info for uma lista, recebe as
+    informações de depuração de cada parágrafo classificado. Com um
+    MemoParagrafos, textos já vistos no mesmo contexto não são reclassificados.
+    regras é o ConjuntoRegras usado (por padrão, as regras padrão).
+    """
+    regras = regras or REGRAS
+    if memo is not None:
+        classificar = lambda texto, em_pedidos: memo.classificar(texto, em_pedidos, regras)
+    else:
+        classificar = regras.classificador.classificar
+    em_pedidos = False
+
+    for i, texto in enumerate(textos):
+        texto = texto.strip()
+        # Verificar se é cabeçalho da seção de pedidos ANTES de qualquer outra verificação
+        if regras.classificador.inicia_pedidos(texto):
+            em_pedidos = True
+        # Verificar se deve desativar a seção de pedidos
+        if texto == '' and em_pedidos:
+            em_pedidos = False  # Desativa a seção de pedidos ao encontrar parágrafo vazio
+
+        if not texto:
+            yield texto, None
+            continue
+
+        # Detectar tipo de parágrafo
+        tipo, negrito, alinhamento = classificar(texto, em_pedidos)
+
+        # Armazenar informações para depuração
+        if debug_info is not None:
+            debug_info.append({
+                "index": i,
+                "texto": texto[:50] + "..." if len(texto) > 50 else texto,
+                "tipo_detectado": tipo,
+                "negrito": negrito,
+                "alinhamento": alinhamento,
+                "em_pedidos": em_pedidos,
+                "alinhamento_aplicado": 'justify' if em_pedidos else alinhamento
+            })
+
+        yield texto, tipo
+
+        # Ativar modo Pedidos quando detectado
+        if tipo == 'secao_pedidos':
+            em_pedidos = True
+
+
+def classificar_paragrafos_lote(textos, debug_info=None, memo=None, regras=None):
+    """
+    Versão em lote de classificar_paragrafos, para quando todos os textos já
+    estão em memória: calcula o estado da seção de pedidos de todos os
+    parágrafos em uma passada e classifica todos de uma vez.
+
+    Retorna a lista de (texto, tipo), igual a
+    list(classificar_paragrafos(textos, debug_info, memo, regras)).
+    """
+    regras = regras or REGRAS
+    if regras.classificador.abre_pedidos:
+        # O estado de cada parágrafo depende da classificação do anterior
+        return list(classificar_paragrafos(textos, debug_info, memo, regras))
+    limpos = [texto.strip() for texto in textos]
+    estados = regras.classificador.estados_pedidos(limpos)
+    if memo is not None:
+        resultados = memo.classificar_lote(limpos, estados, regras)
+    else:
+        resultados = regras.classificador.classificar_lote(limpos, estados)
+
+    if debug_info is not None:
+        for i, (texto, em_pedidos, resultado) in enumerate(zip(limpos, estados, resultados)):
+            if resultado is None:
+                continue
+            tipo, negrito, alinhamento = resultado
+            debug_info.append({
+                "index": i,
+                "texto": texto[:50] + "..." if len(texto) > 50 else texto,
+                "tipo_detectado": tipo,
+                "negrito": negrito,
+                "alinhamento": alinhamento,
+                "em_pedidos": em_pedidos,
+                "alinhamento_aplicado": 'justify' if em_pedidos else alinhamento
+            })
+
+    return [(texto, resultado[0] if resultado is not None else None)
+            for texto, resultado in zip(limpos, resultados)]
+
+
+# Hash do conteúdo de cada logo por (caminho, data de modificação, tamanho),
+# para não reler a imagem a cada documento
+_HASHES_LOGOS = {}
+_MAX_HASHES_LOGOS = 8
+_TRAVA_HASHES = threading.Lock()
+
+
+def _hash_logo(logo_path):
+    info = os.stat(logo_path)
+    chave = (logo_path, info.st_mtime_ns, info.st_size)
+    with _TRAVA_HASHES:
+        valor = _HASHES_LOGOS.get(chave)
+    if valor is None:
+        with open(logo_path, 'rb') as f:
+            valor = hashlib.sha256(f.read()).digest()
+        with _TRAVA_HASHES:
+            if len(_HASHES_LOGOS) >= _MAX_HASHES_LOGOS:
+                _HASHES_LOGOS.clear()
+            _HASHES_LOGOS[chave] = valor
+    return valor
+
+
+def chave_modelo_timbrado(logo_path=None, regras_path=None):
+    """
+    Chave do papel timbrado: hash do conteúdo do logo e das configurações de
+    rodapé, formatação e estilos (incluindo os do arquivo de regras). Alterar
+    qualquer um deles gera um novo modelo.
+    """
+    h = hashlib.sha256()
+    if logo_path and os.path.exists(logo_path):
+        h.update(_hash_logo(logo_path))
+    h.update(f"logo={LOGO_CONFIG['largura_polegadas']}".encode('ascii'))
+    h.update(repr(sorted(RODAPE_CONFIG.items())).encode('utf-8'))
+    h.update(repr(sorted(FORMATO_CONFIG.items())).encode('utf-8'))
+    h.update(repr(sorted(estilos_regras(obter_regras(regras_path)).items())).encode('utf-8'))
+    return h.hexdigest()
+
+
+def compressao_membro_zip(nome):
+    """
+    Método de compressão de um membro do ZIP: .docx já é um ZIP comprimido, então
+    é armazenado sem recompressão; os demais arquivos são comprimidos.
+    """
+    if nome.lower().endswith(('.docx', '.zip', '.png', '.jpg', '.jpeg')):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+class ArquivoZip:
+    """
+    ZIP escrito aos poucos, um membro por vez, à medida que cada documento fica
+    pronto. Sem destino, é gravado em memória até limite_memoria bytes e em um
+    arquivo temporário daí em diante. O destino pode ser qualquer arquivo
+    binário aberto para escrita, inclusive um que não aceite seek (ex.: a
+    resposta HTTP), caso em que o ZIP é transmitido enquanto é escrito.
+    """
+
+    def __init__(self, destino=None, limite_memoria=None):
+        if destino is None:
+            destino = tempfile.SpooledTemporaryFile(
+                max_size=limite_memoria or PROCESSAMENTO_CONFIG['limite_zip_memoria']
+            )
+        self.destino = destino
+        self.quantidade = 0
+        self._zip = zipfile.ZipFile(destino, 'w')
+        self._leitor = None
+        self._trava = threading.Lock()
+
+    @property
+    def fechado(self):
+        return self._zip.fp is None
+
+    def adicionar(self, nome, dados):
+        """
+        Acrescenta um membro a partir de bytes ou do caminho de um arquivo em
+        disco e retorna sua posição no ZIP (ver ler).
+        """
+        with self._trava:
+            if isinstance(dados, (bytes, bytearray, memoryview)):
+                self._zip.writestr(nome, dados, compress_type=compressao_membro_zip(nome))
+            else:
+                self._zip.write(dados, nome, compress_type=compressao_membro_zip(nome))
+            self.quantidade += 1
+            return self.quantidade - 1
+
+    def ler(self, posicao):
+        """Conteúdo do membro na posição dada, na ordem em que foi adicionado; o ZIP deve estar fechado."""
+        with self._trava:
+            if self._leitor is None:
+                self._leitor = zipfile.ZipFile(self.destino)
+            return self._leitor.read(self._leitor.infolist()[posicao])
+
+    def fechar(self):
+        """Grava o diretório central e retorna o destino, posicionado no início quando possível."""
+        with self._trava:
+            if self._zip.fp is not None:
+                self._zip.close()
+            if self.destino.seekable():
+                self.destino.seek(0)
+            return self.destino
+
+
+class LeitorArquivo(io.RawIOBase):
+    """
+    Leitura de um arquivo binário aberto (ex.: o SpooledTemporaryFile de um
+    ArquivoZip) como um io.RawIOBase, para APIs que só aceitam os tipos de io.
+    Fechar o leitor não fecha o arquivo.
+    """
+
+    def __init__(self, arquivo):
+        self._arquivo = arquivo
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, posicao, origem=io.SEEK_SET):
+        return self._arquivo.seek(posicao, origem)
+
+    def tell(self):
+        return self._arquivo.tell()
+
+    def readinto(self, buffer):
+        dados = self._arquivo.read(len(buffer))
+        buffer[:len(dados)] = dados
+        return len(dados)
+
+
+def criar_arquivo_zip(arquivos):
+    """
+    Cria um arquivo ZIP contendo todos os arquivos processados.
+    Cada item é uma tupla (nome, dados) ou o caminho de um arquivo em disco.
+    """
+    zip_arquivo = ArquivoZip(io.BytesIO())
+    for arquivo in arquivos:
+        if isinstance(arquivo, tuple):
+            zip_arquivo.adicionar(*arquivo)
+        else:
+            zip_arquivo.adicionar(os.path.basename(arquivo), arquivo)
+    return zip_arquivo.fechar()
+
+
+def usar_streaming(tamanho, streaming=None):
+    """
+    Indica se uma entrada de tamanho bytes usa o modo streaming: quando pedido
+    explicitamente ou quando a entrada passa do limite configurado.
+    """
+    if streaming is None:
+        return tamanho > PROCESSAMENTO_CONFIG['limite_streaming']
+    return streaming
+
+
+def preparar_processo(logo_path=None):
+    """
+    Inicializador dos processos de trabalho: carrega o papel timbrado do logo.
+    O python-docx é importado no próprio processo, não no que cria o pool.
+    """
+    _documento().obter_modelo_timbrado(logo_path)
+
+
+def escolher_formatador(tamanho, streaming=None):
+    """Retorna a função de formatação para uma entrada de tamanho bytes (ver usar_streaming)."""
+    documento = _documento()
+    return documento.formatar_documento_streaming if usar_streaming(tamanho, streaming) else documento.formatar_documento
+
+
+def nome_formatado(nome):
+    """Nome do arquivo de saída para um arquivo de entrada."""
+    nome_base = os.path.splitext(nome)[0]
+    return f"{nome_base}_FORMATADO.docx"
+
+
+def chave_resultado(dados, logo_path=None, streaming=None, preservar_runs=False, regras_path=None):
+    """
+    Chave do resultado da formatação: hash da entrada, do papel timbrado (logo e
+    configurações), das regras de classificação e do modo de formatação.
+    """
+    h = hashlib.sha256(dados)
+    h.update(chave_modelo_timbrado(logo_path, regras_path).encode('ascii'))
+    h.update(f"regras={obter_regras(regras_path).chave}".encode('ascii'))
+    modo = 'formatar_documento_streaming' if usar_streaming(len(dados), streaming) else 'formatar_documento'
+    h.update(modo.encode('ascii'))
+    if preservar_runs:
+        # A versão muda quando a ênfase preservada muda (2: estilos de caractere)
+        h.update(b'preservar_runs=2')
+    return h.hexdigest()
+
+
+def formatar_arquivo(nome, dados, logo_path=None, debug_mode=False, streaming=None, instrumentar=False,
+                     preservar_runs=False, regras_path=None):
+    """
+    Formata um único arquivo .docx recebido em bytes, inteiramente em memória.
+    Retorna (nome_saida, dados_saida, debug_info, relatorio), em que relatorio
+    traz as medições por etapa quando instrumentar for verdadeiro.
+    """
+    instrumentacao = Instrumentacao() if instrumentar else None
+    formatar = escolher_formatador(len(dados), streaming)
+    resultado = formatar(io.BytesIO(dados), None, logo_path, debug_mode, instrumentacao=instrumentacao,
+                         preservar_runs=preservar_runs, regras_path=regras_path)
+
+    if debug_mode:
+        saida, debug_info = resultado
+    else:
+        saida, debug_info = resultado, None
+    relatorio = instrumentacao.relatorio() if instrumentar else None
+    return nome_formatado(nome), saida.getvalue(), debug_info, relatorio
+
+
+def formatar_caminho(caminho_entrada, caminho_saida, logo_path=None, debug_mode=False, streaming=None,
+                     instrumentar=False, preservar_runs=False, regras_path=None):
+    """
+    Formata um arquivo .docx já existente em disco, sem cópia intermediária.
+    Retorna (caminho_saida, debug_info, relatorio).
+    """
+    instrumentacao = Instrumentacao() if instrumentar else None
+    formatar = escolher_formatador(os.path.getsize(caminho_entrada), streaming)
+    resultado = formatar(caminho_entrada, caminho_saida, logo_path, debug_mode, instrumentacao=instrumentacao,
+                         preservar_runs=preservar_runs, regras_path=regras_path)
+
+    if debug_mode:
+        saida, debug_info = resultado
+    else:
+        saida, debug_info = resultado, None
+    relatorio = instrumentacao.relatorio() if instrumentar else None
+    return saida, debug_info, relatorio
+
+
+def _executar_isolado(funcao, args):
+    """
+    Executa funcao(*args) capturando erros, para que a falha de um documento
+    não interrompa o lote nem dependa de a exceção ser serializável entre processos.
+    """
+    try:
+        return funcao(*args), None
+    except Exception as e:
+        return None, str(e)
+
+
+def executar_lote(funcao, tarefas, max_workers=None):
+    """
+    Executa funcao(*args) para cada tupla de args em tarefas, em paralelo quando
+    houver mais de um processo disponível. funcao deve ser definida no nível de
+    um módulo importável.
+
+    Gera tuplas (indice, resultado, erro) à medida que cada tarefa termina, fora
+    de ordem; o índice permite ao chamador reconstruir a ordem original.
+    """
+    if max_workers is None:
+        max_workers = PROCESSAMENTO_CONFIG['max_workers']
+    max_workers = max(1, min(max_workers, len(tarefas)))
+
+    # Com um único processo, executar no próprio processo evita o custo do pool
+    if max_workers == 1:
+        for i, args in enumerate(tarefas):
+            resultado, erro = _executar_isolado(funcao, args)
+            yield i, resultado, erro
+        return
+
+    # O pool de processos só é importado quando o lote é de fato paralelo
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    contexto = multiprocessing.get_context(PROCESSAMENTO_CONFIG['metodo_inicio'])
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=contexto) as executor:
+        futuros = {
+            executor.submit(_executar_isolado, funcao, args): i
+            for i, args in enumerate(tarefas)
+        }
+        for futuro in as_completed(futuros):
+            i = futuros[futuro]
+            try:
+                resultado, erro = futuro.result()
+            except Exception as e:  # Falha do próprio processo de trabalho
+                resultado, erro = None, str(e)
+            yield i, resultado, erro
+
+
+def formatar_lote(arquivos, logo_path=None, debug_mode=False, max_workers=None, cache=None,
+                  instrumentar=False, preservar_runs=False, regras_path=None):
+    """
+    Formata vários documentos, em paralelo quando houver mais de um processo disponível.
+
+    arquivos é uma lista de tuplas (nome, dados). Gera tuplas
+    (indice, nome, resultado, erro) à medida que cada documento termina, fora de
+    ordem; o índice permite ao chamador reconstruir a ordem original.
+    resultado é (nome_saida, dados_saida, debug_info, relatorio) ou None se houve
+    erro; relatorio só é preenchido com instrumentar verdadeiro e para documentos
+    que não vieram do cache.
+
+    Com um CacheResultados, documentos já formatados com o mesmo logo, as mesmas
+    regras e as mesmas configurações são devolvidos do cache, e os novos resultados são guardados nele.
+    """
+    pendentes = []
+    chaves = {}
+    for i, (nome, dados) in enumerate(arquivos):
+        if cache is not None:
+            chaves[i] = chave_resultado(dados, logo_path, preservar_runs=preservar_runs, regras_path=regras_path)
+            encontrado = cache.obter(chaves[i], debug_mode)
+            if encontrado is not None:
+                dados_saida, debug_info = encontrado
+                yield i, nome, (nome_formatado(nome), dados_saida, debug_info, None), None
+                continue
+        pendentes.append(i)
+
+    tarefas = [(arquivos[i][0], arquivos[i][1], logo_path, debug_mode, None, instrumentar, preservar_runs,
+                regras_path)
+               for i in pendentes]
+    for j, resultado, erro in executar_lote(formatar_arquivo, tarefas, max_workers):
+        i = pendentes[j]
+        if erro is None and cache is not None:
+            try:
+                cache.guardar(chaves[i], resultado[1], resultado[2])
+            except OSError:
+                pass  # O cache é só uma otimização; falhas de disco não afetam o lote
+        yield i, arquivos[i][0], resultado, erro
@@ -0,0 +1,171 @@
+"""
+Preparação do logo do cabeçalho: redimensionamento para o tamanho de impressão
+e cache em disco endereçado pelo conteúdo da imagem enviada.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import time
+
+# Configurações do logo do cabeçalho
+LOGO_CONFIG = {
+    'largura_polegadas': 2.5,  # Largura do logo impresso no cabeçalho
+    'dpi': 300,  # Resolução de impressão; imagens maiores são reduzidas para ela
+    'qualidade_jpeg': 90,  # Usada quando o JPEG fica menor que o PNG (imagens sem transparência)
+    'diretorio': os.environ.get('FORMATADOR_LOGO_DIR',
+                                os.path.join(tempfile.gettempdir(), 'formatador_ica_logos')),
+    'tamanho_maximo': 64 * 1024 * 1024,  # Bytes; os logos usados há mais tempo saem primeiro
+    # Segundos; logos usados há menos tempo nunca são removidos, pois podem estar
+    # em uso por um trabalho da fila (cada trabalho marca o uso do seu logo ao iniciar)
+    'uso_recente': 60 * 60,
+}
+
+ORIENTACAO_EXIF = 0x0112  # Tag EXIF com a rotação da foto
+
+# Formatos que podem ser usados sem recodificação quando a imagem já é pequena
+_FORMATOS_ORIGINAIS = {'PNG': '.png', 'JPEG': '.jpg'}
+
+
+def chave_logo(dados):
+    """Hash do conteúdo do logo e das configurações que afetam a imagem preparada."""
+    h = hashlib.sha256(dados)
+    for nome in ('largura_polegadas', 'dpi', 'qualidade_jpeg'):
+        h.update(f"{nome}={LOGO_CONFIG[nome]}".encode('ascii'))
+    return h.hexdigest()
+
+
+def normalizar_logo(dados):
+    """
+    Reduz a imagem à largura de impressão do cabeçalho na resolução configurada
+    e a recodifica no formato menor (PNG ou, sem transparência, JPEG).
+    Retorna (extensao, dados). Lança ValueError se a imagem não puder ser lida.
+    """
+    # Importado aqui: quem só lê LOGO_CONFIG ou o cache em disco não precisa do Pillow
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(dados)) as original:
+            formato = original.format
+            rotacionada = original.getexif().get(ORIENTACAO_EXIF, 1) != 1
+            imagem = ImageOps.exif_transpose(original)
+            transparente = imagem.mode in ('RGBA', 'LA', 'PA') or 'transparency' in imagem.info
+            imagem = imagem.convert('RGBA' if transparente else 'RGB')
+    except (UnidentifiedImageError, OSError) as e:
+        raise ValueError("Imagem do logo inválida ou em formato não suportado") from e
+
+    largura = round(LOGO_CONFIG['largura_polegadas'] * LOGO_CONFIG['dpi'])
+    reduzida = imagem.width > largura
+    if reduzida:
+        altura = max(1, round(imagem.height * largura / imagem.width))
+        imagem = imagem.resize((largura, altura), Image.LANCZOS)
+
+    dpi = (LOGO_CONFIG['dpi'], LOGO_CONFIG['dpi'])
+    candidatos = []
+    png = io.BytesIO()
+    imagem.save(png, 'PNG', optimize=True, dpi=dpi)
+    candidatos.append(('.png', png.getvalue()))
+    if not transparente:
+        jpeg = io.BytesIO()
+        imagem.save(jpeg, 'JPEG', quality=LOGO_CONFIG['qualidade_jpeg'], optimize=True, dpi=dpi)
+        candidatos.append(('.jpg', jpeg.getvalue()))
+    # Uma imagem já pequena e bem comprimida pode ficar maior ao ser recodificada
+    if not reduzida and not rotacionada and formato in _FORMATOS_ORIGINAIS:
+        candidatos.append((_FORMATOS_ORIGINAIS[formato], dados))
+
+    return min(candidatos, key=lambda candidato: len(candidato[1]))
+
+
+def preparar_logo(dados, diretorio=None):
+    """
+    Retorna o caminho do logo preparado por normalizar_logo, guardado em
+    diretorio com o hash do conteúdo no nome. O mesmo logo enviado de novo, em
+    qualquer sessão ou processo, reaproveita o arquivo já preparado.
+    Lança ValueError se a imagem não puder ser lida.
+    """
+    diretorio = diretorio or LOGO_CONFIG['diretorio']
+    base = os.path.join(diretorio, chave_logo(dados))
+    for extensao in ('.png', '.jpg'):
+        try:
+            os.utime(base + extensao)  # Marcar como usado recentemente
+            return base + extensao
+        except OSError:
+            pass
+
+    extensao, preparado = normalizar_logo(dados)
+    os.makedirs(diretorio, exist_ok=True)
+    fd, temporario = tempfile.mkstemp(dir=diretorio, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(preparado)
+        os.replace(temporario, base + extensao)
+    except OSError:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+    limpar_logos(diretorio)
+    return base + extensao
+
+
+def _logos(diretorio):
+    """Lista (ultimo_uso, tamanho, caminho) dos arquivos do diretório, do uso mais antigo ao mais recente."""
+    itens = []
+    try:
+        with os.scandir(diretorio) as entradas:
+            for entrada in entradas:
+                try:
+                    info = entrada.stat()
+                except OSError:
+                    continue
+                itens.append((info.st_mtime, info.st_size, entrada.path))
+    except FileNotFoundError:
+        pass
+    itens.sort()
+    return itens
+
+
+def tamanho_logos(diretorio=None):
+    """Bytes ocupados pelos logos preparados."""
+    return sum(tamanho for _, tamanho, _ in _logos(diretorio or LOGO_CONFIG['diretorio']))
+
+
+def limpar_logos(diretorio=None):
+    """
+    Remove os temporários de gravações interrompidas e, acima do tamanho
+    máximo, os logos usados há mais tempo, exceto os usados há menos de
+    uso_recente segundos.
+    """
+    itens = _logos(diretorio or LOGO_CONFIG['diretorio'])
+    total = sum(tamanho for _, tamanho, _ in itens)
+    agora = time.time()
+    abandonados = agora - 60 * 60
+    recentes = agora - LOGO_CONFIG['uso_recente']
+    for ultimo_uso, tamanho, caminho in itens:
+        excedente = total > LOGO_CONFIG['tamanho_maximo'] and ultimo_uso < recentes
+        if not excedente and not (caminho.endswith('.tmp') and ultimo_uso < abandonados):
+            continue
+        try:
+            os.remove(caminho)
+        except OSError:
+            continue
+        total -= tamanho
+
+
+def marcar_uso_logo(caminho, diretorio=None):
+    """
+    Marca o logo preparado como usado agora, para que limpar_logos não o
+    remova. Arquivos fora do diretório dos preparados não são alterados.
+    """
+    diretorio = os.path.abspath(diretorio or LOGO_CONFIG['diretorio'])
+    if os.path.dirname(os.path.abspath(caminho)) != diretorio:
+        return
+    try:
+        os.utime(caminho)
+    except OSError:
+        pass  # Já removido: a formatação reporta o erro
+
+
+def preparar_logo_arquivo(caminho, diretorio=None):
+    """Como preparar_logo, para um logo já gravado em disco."""
+    with open(caminho, 'rb') as f:
+        return preparar_logo(f.read(), diretorio)
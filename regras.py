@@ -0,0 +1,427 @@
+"""
+Regras de classificação de parágrafos em formato declarativo.
+
+Um conjunto de regras é um arquivo JSON com as chaves:
+
+    regras          Lista de regras. Cada uma tem "tipo", "negrito" (padrão
+                    false), "alinhamento" (padrão "justify"), "prioridade"
+                    (padrão 0) e exatamente uma condição: "inicio" (regex que
+                    deve casar no início do texto), "busca" (regex procurada em
+                    qualquer posição) ou "heuristica" (nome de uma função de
+                    HEURISTICAS). Opcionais: "ignorar_maiusculas" e
+                    "so_em_pedidos" (a regra só vale dentro da seção de pedidos).
+                    Flags no início de um padrão, como (?i), valem só para a
+                    própria regra.
+    herdar_padrao   Se verdadeiro (padrão), as regras se somam às de
+                    REGRAS_PADRAO; se falso, as substituem.
+    inicio_pedidos  Regex do cabeçalho que abre a seção de pedidos (padrão: o
+                    de REGRAS_PADRAO).
+    estilos         Estilo de parágrafo por tipo, com os mesmos campos de
+                    formatador.ESTILOS_CONFIG (cores como listas [r, g, b]).
+                    Sobrepõem os estilos padrão; tipos sem estilo usam 'normal'.
+
+As regras são avaliadas da maior para a menor prioridade (empates na ordem em
+que aparecem, com as padrão antes das do arquivo) e a primeira que casar define
+o tipo; textos que não casam com nenhuma são 'normal', justificados. Exemplo:
+
+    {"regras": [{"tipo": "preliminar", "inicio": "PRELIMINARMENTE",
+                 "ignorar_maiusculas": true, "negrito": true,
+                 "alinhamento": "left", "prioridade": 650}],
+     "estilos": {"preliminar": {"nome": "ICA Preliminar", "alinhamento": "left",
+                                "negrito": true, "recuo_primeira_linha": false}}}
+
+Cada arquivo é compilado uma única vez por conteúdo (ver obter_regras).
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# Aspas retas, curvas, angulares, duplas baixas e orientais
+ASPAS = '"\'“”‘’«»‹›„‟「」『』'
+
+_RE_MARCADOR_TITULO = re.compile(r'[•▪\-*]')
+_RE_NUMERADO_INICIO = re.compile(r'^\s*\d+[\.\)]')
+# Flags globais no início de um padrão: (?i), (?ms) etc.
+_RE_FLAGS_INICIAIS = re.compile(r'\(\?([aiLmsux]+)\)')
+# Referências a grupos em um padrão: \1, (?P=nome) e condicionais (?(1)...)
+_RE_REFERENCIA_GRUPO = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]|\(\?P=|\(\?\(')
+
+
+def _titulo_acao(texto):
+    """Título da ação: curto, com "AÇÃO DE" e sem marcadores ou numeração."""
+    maiusculo = texto.upper()
+    return ('AÇÃO DE' in maiusculo and
+            len(texto) < 150 and
+            maiusculo.count(' ') >= 2 and
+            not _RE_MARCADOR_TITULO.search(texto) and
+            not _RE_NUMERADO_INICIO.match(texto))
+
+
+def _titulo(texto):
+    """Textos que parecem títulos: curtos, sem ponto final e com as palavras longas em maiúscula."""
+    if len(texto) >= 50 or texto.endswith('.'):
+        return False
+    palavras = texto.split()
+    return 2 <= len(palavras) <= 7 and all(p[0].isupper() for p in palavras if len(p) > 3)
+
+
+# Condições que não se expressam como uma regex, referenciadas pelo nome nas regras
+HEURISTICAS = {
+    'titulo_acao': _titulo_acao,
+    'titulo': _titulo,
+}
+
+# Regras do escritório, na ordem de prioridade de sempre
+REGRAS_PADRAO = {
+    'inicio_pedidos': r'^(PEDIDOS|POR TUDO ISSO|DOS PEDIDOS|DO PEDIDO|IV[\s]*[.\-–—]+[\s]*DOS PEDIDOS)',
+    'regras': [
+        # Estrutura específica
+        {'tipo': 'secao_principal', 'negrito': True, 'alinhamento': 'left', 'prioridade': 1000,
+         'inicio': r'(PEDIDOS|POR TUDO ISSO|DOS PEDIDOS|DO PEDIDO|IV[\s]*[.\-–—]+[\s]*DOS PEDIDOS)',
+         'ignorar_maiusculas': True},
+        {'tipo': 'item_pedido', 'alinhamento': 'justify', 'prioridade': 900,
+         'inicio': r'\s*\d+[\.\)]\s+', 'so_em_pedidos': True},
+        {'tipo': 'item_doc', 'alinhamento': 'left', 'prioridade': 800, 'inicio': r'\s*Doc\.\s*\d+'},
+        {'tipo': 'cabecalho', 'negrito': True, 'alinhamento': 'center', 'prioridade': 700,
+         'inicio': r'(EXMO|EXCELENTÍSSIM[OA])\b', 'ignorar_maiusculas': True},
+        # Citações: artigos e parágrafos no início; aspas, incisos e alíneas em qualquer posição
+        {'tipo': 'citacao', 'alinhamento': 'justify', 'prioridade': 600, 'inicio': r'(?:Art\.\s*\d|§\s*\d)'},
+        {'tipo': 'citacao', 'alinhamento': 'justify', 'prioridade': 600, 'busca': '[' + re.escape(ASPAS) + ']'},
+        {'tipo': 'citacao', 'alinhamento': 'justify', 'prioridade': 600,
+         'busca': r'inciso\s+[IVX]|alínea\s+[a-z]'},
+        # Marcadores e listas (1., 2), a., b))
+        {'tipo': 'subsecao', 'negrito': True, 'alinhamento': 'left', 'prioridade': 500,
+         'inicio': r'\s*[•▪■□◊○●◉◎◌◦⦿⦾]+\s+'},
+        {'tipo': 'lista', 'alinhamento': 'left', 'prioridade': 400, 'inicio': r'\s*(?:\d+|[a-z])[\.\)]\s+'},
+        # Seções principais em algarismos romanos
+        {'tipo': 'secao_principal', 'negrito': True, 'alinhamento': 'left', 'prioridade': 300,
+         'inicio': r'[IVX]+[\s]*[.–—\-]+[\s]*(DOS?|DAS?)[\s]+[A-ZÀÁÂÃÉÊÍÓÔÕÚÇ\s]+$'},
+        {'tipo': 'titulo_acao', 'negrito': True, 'alinhamento': 'center', 'prioridade': 200,
+         'heuristica': 'titulo_acao'},
+        # Outros marcadores de lista
+        {'tipo': 'lista', 'alinhamento': 'left', 'prioridade': 100, 'inicio': r'\s*[\-–—*+]\s+'},
+        # Textos que parecem títulos (normal, mas em negrito)
+        {'tipo': 'normal', 'negrito': True, 'alinhamento': 'left', 'prioridade': 0, 'heuristica': 'titulo'},
+    ],
+}
+
+ALINHAMENTOS_VALIDOS = ('center', 'justify', 'left')
+
+# Campos aceitos em um estilo: os parâmetros de documento.criar_estilo_paragrafo
+# (manter em sincronia), com o tipo esperado de cada um
+CAMPOS_ESTILO = {
+    'nome': str,
+    'alinhamento': str,
+    'negrito': bool,
+    'italico': bool,
+    'tamanho_fonte': (int, float),
+    'espacamento_antes': (int, float),
+    'espacamento_depois': (int, float),
+    'espacamento_linha': (int, float),
+    'cor_texto': list,
+    'recuo_lista': bool,
+    'recuo_primeira_linha': bool,
+    'linha_horizontal': bool,
+}
+RESULTADO_PADRAO = ('normal', False, 'justify')
+
+
+class ClassificadorParagrafos:
+    """
+    Classificador de parágrafos compilado a partir de uma lista de regras.
+
+    Na criação, as regras são ordenadas por prioridade e agrupadas em etapas:
+    regras "inicio" vizinhas viram uma única alternância (as alternativas são
+    tentadas na ordem e o grupo que casou indica a regra); buscas e
+    heurísticas são etapas próprias. Há um plano com as regras so_em_pedidos
+    e outro sem elas.
+    """
+
+    # Incrementar sempre que a avaliação das regras mudar, para invalidar resultados em cache
+    VERSAO = 2
+
+    def __init__(self, regras=None, inicio_pedidos=None):
+        if regras is None:
+            regras = REGRAS_PADRAO['regras']
+        self.re_pedidos = re.compile(inicio_pedidos or REGRAS_PADRAO['inicio_pedidos'], re.IGNORECASE)
+        ordenadas = sorted(regras, key=lambda regra: -regra.get('prioridade', 0))
+        # Um parágrafo classificado como 'secao_pedidos' abre a seção de pedidos para
+        # os seguintes, então o estado passa a depender da classificação (ver estados_pedidos)
+        self.abre_pedidos = any(regra['tipo'] == 'secao_pedidos' for regra in ordenadas)
+        self.plano_em_pedidos = self._compilar(ordenadas)
+        self.plano = self._compilar([regra for regra in ordenadas if not regra.get('so_em_pedidos')])
+
+    @staticmethod
+    def _padrao(regra, chave):
+        padrao = regra[chave]
+        # Flags no início do padrão, como (?i), valem só para a própria regra
+        flags = _RE_FLAGS_INICIAIS.match(padrao)
+        if flags:
+            padrao = f'(?{flags.group(1)}:{padrao[flags.end():]})'
+        return f'(?i:{padrao})' if regra.get('ignorar_maiusculas') else f'(?:{padrao})'
+
+    @staticmethod
+    def _isolada(padrao):
+        """
+        Indica se o padrão precisa de uma etapa própria: grupos nomeados e
+        referências a grupos mudariam de sentido (ou nem compilariam) dentro da
+        alternância, em que cada regra vira um grupo a mais.
+        """
+        return bool(re.compile(padrao).groupindex) or _RE_REFERENCIA_GRUPO.search(padrao) is not None
+
+    @classmethod
+    def _compilar(cls, regras):
+        """Retorna a lista de etapas (função, resultados, agrupada), na ordem de avaliação."""
+        etapas = []
+        for regra in regras:
+            resultado = (regra['tipo'], bool(regra.get('negrito', False)), regra.get('alinhamento', 'justify'))
+            anterior = etapas[-1] if etapas else None
+            if 'heuristica' in regra:
+                etapas.append(['heuristica', HEURISTICAS[regra['heuristica']], resultado])
+            elif 'inicio' in regra and cls._isolada(regra['inicio']):
+                etapas.append(['inicio_isolado', cls._padrao(regra, 'inicio'), resultado])
+            elif 'inicio' in regra:
+                if anterior is not None and anterior[0] == 'inicio':
+                    anterior[1].append(cls._padrao(regra, 'inicio'))
+                    anterior[2].append(resultado)
+                else:
+                    etapas.append(['inicio', [cls._padrao(regra, 'inicio')], [resultado]])
+            else:
+                # Buscas ficam separadas: uma alternância impede o motor de regex
+                # de saltar direto para os caracteres iniciais possíveis
+                etapas.append(['busca', cls._padrao(regra, 'busca'), resultado])
+
+        # Cada etapa é (função, resultados, agrupada): nas alternâncias, resultados
+        # mapeia o nome do grupo que casou para o resultado da regra
+        plano = []
+        for modo, condicao, resultados in etapas:
+            if modo == 'inicio':
+                regex = re.compile('|'.join(f'(?P<r{n}>{padrao})' for n, padrao in enumerate(condicao)))
+                plano.append((regex.match, {f'r{n}': resultado for n, resultado in enumerate(resultados)}, True))
+            elif modo == 'inicio_isolado':
+                plano.append((re.compile(condicao).match, resultados, False))
+            elif modo == 'busca':
+                plano.append((re.compile(condicao).search, resultados, False))
+            else:
+                plano.append((condicao, resultados, False))
+        return plano
+
+    @staticmethod
+    def _avaliar(plano, texto):
+        for funcao, resultados, agrupada in plano:
+            casamento = funcao(texto)
+            if casamento:
+                return resultados[casamento.lastgroup] if agrupada else resultados
+        return RESULTADO_PADRAO
+
+    def inicia_pedidos(self, texto):
+        """Indica se o texto é o cabeçalho da seção de pedidos."""
+        return self.re_pedidos.match(texto) is not None
+
+    def classificar(self, texto, em_pedidos=False):
+        """
+        Retorna a tupla (tipo, negrito, alinhamento) do parágrafo.
+        """
+        return self._avaliar(self.plano_em_pedidos if em_pedidos else self.plano, texto.strip())
+
+    def estados_pedidos(self, textos):
+        """
+        Indica, para cada texto (já sem espaços nas pontas), se ele está dentro da
+        seção de pedidos: ela começa no cabeçalho dos pedidos e termina no
+        primeiro parágrafo vazio. Só considera o cabeçalho (inicio_pedidos): com
+        abre_pedidos, a abertura pela classificação exige classificar em sequência.
+        """
+        estados = []
+        em_pedidos = False
+        for texto in textos:
+            if not texto:
+                em_pedidos = False
+            elif self.re_pedidos.match(texto):
+                em_pedidos = True
+            estados.append(em_pedidos)
+        return estados
+
+    def classificar_lote(self, textos, estados=None):
+        """
+        Classifica uma lista de textos de uma só vez. Retorna uma lista com a
+        tupla (tipo, negrito, alinhamento) de cada texto, ou None para os vazios,
+        com os mesmos resultados de classificar. estados é a lista de
+        estados_pedidos, calculada a partir dos textos se omitida; textos
+        repetidos no mesmo estado são classificados uma única vez.
+        """
+        limpos = [texto.strip() for texto in textos]
+        if estados is None:
+            estados = self.estados_pedidos(limpos)
+
+        resultados = []
+        vistos = {}
+        for texto, em_pedidos in zip(limpos, estados):
+            if not texto:
+                resultados.append(None)
+                continue
+            chave = (texto, em_pedidos)
+            resultado = vistos.get(chave)
+            if resultado is None:
+                resultado = self._avaliar(self.plano_em_pedidos if em_pedidos else self.plano, texto)
+                vistos[chave] = resultado
+            resultados.append(resultado)
+        return resultados
+
+
+class ConjuntoRegras:
+    """
+    Um conjunto de regras compilado: o classificador, os estilos por tipo e a
+    chave (hash do conteúdo e da versão do classificador) que identifica os
+    resultados produzidos com ele em caches.
+    """
+
+    def __init__(self, dados, chave):
+        self.chave = chave
+        regras = list(dados.get('regras', []))
+        if dados.get('herdar_padrao', True):
+            regras = REGRAS_PADRAO['regras'] + regras
+        self.classificador = ClassificadorParagrafos(regras, dados.get('inicio_pedidos'))
+        self.estilos = {
+            tipo: {campo: tuple(valor) if isinstance(valor, list) else valor for campo, valor in estilo.items()}
+            for tipo, estilo in dados.get('estilos', {}).items()
+        }
+
+
+def validar_regras(dados):
+    """Lança ValueError se o conteúdo de um arquivo de regras for inválido."""
+    if not isinstance(dados, dict) or not isinstance(dados.get('regras', []), list):
+        raise ValueError("O arquivo de regras deve ser um objeto com a lista 'regras'")
+    if not isinstance(dados.get('herdar_padrao', True), bool):
+        raise ValueError("'herdar_padrao' deve ser true ou false")
+    if 'inicio_pedidos' in dados:
+        if not isinstance(dados['inicio_pedidos'], str):
+            raise ValueError("'inicio_pedidos' deve ser uma expressão regular (texto)")
+        try:
+            re.compile(dados['inicio_pedidos'])
+        except re.error as e:
+            raise ValueError(f"'inicio_pedidos': expressão regular inválida ({e})") from e
+    for n, regra in enumerate(dados.get('regras', []), 1):
+        if not isinstance(regra, dict):
+            raise ValueError(f"Regra {n}: cada regra deve ser um objeto")
+        condicoes = [chave for chave in ('inicio', 'busca', 'heuristica') if chave in regra]
+        if 'tipo' not in regra or len(condicoes) != 1:
+            raise ValueError(f"Regra {n}: informe 'tipo' e exatamente uma de 'inicio', 'busca' ou 'heuristica'")
+        for chave in ('tipo', 'inicio', 'busca', 'heuristica'):
+            if chave in regra and not isinstance(regra[chave], str):
+                raise ValueError(f"Regra {n}: '{chave}' deve ser um texto")
+        for chave in ('negrito', 'ignorar_maiusculas', 'so_em_pedidos'):
+            if not isinstance(regra.get(chave, False), bool):
+                raise ValueError(f"Regra {n}: '{chave}' deve ser true ou false")
+        prioridade = regra.get('prioridade', 0)
+        if not isinstance(prioridade, (int, float)) or isinstance(prioridade, bool):
+            raise ValueError(f"Regra {n}: 'prioridade' deve ser um número")
+        if regra.get('alinhamento', 'justify') not in ALINHAMENTOS_VALIDOS:
+            raise ValueError(f"Regra {n}: alinhamento deve ser um de {', '.join(ALINHAMENTOS_VALIDOS)}")
+        if 'heuristica' in regra and regra['heuristica'] not in HEURISTICAS:
+            raise ValueError(f"Regra {n}: heurística desconhecida '{regra['heuristica']}'")
+        for chave in ('inicio', 'busca'):
+            if chave in regra:
+                try:
+                    # Como a regra é compilada no classificador, e não só o padrão isolado
+                    re.compile(ClassificadorParagrafos._padrao(regra, chave))
+                except re.error as e:
+                    raise ValueError(f"Regra {n}: expressão regular inválida ({e})") from e
+    estilos = dados.get('estilos', {})
+    if not isinstance(estilos, dict):
+        raise ValueError("'estilos' deve ser um objeto com um estilo por tipo")
+    for tipo, estilo in estilos.items():
+        _validar_estilo(tipo, estilo)
+
+    # Os nomes não podem repetir os de outros tipos (inclusive os estilos padrão); os do
+    # documento base do python-docx são conferidos por documento.verificar_estilos
+    from formatador import ESTILOS_CONFIG
+    tipos_por_nome = {}
+    for tipo, estilo in {**ESTILOS_CONFIG, **estilos}.items():
+        nome = estilo['nome'].lower()
+        if nome in tipos_por_nome:
+            raise ValueError(f"Estilo '{tipo}': o nome '{estilo['nome']}' já é usado pelo estilo "
+                             f"'{tipos_por_nome[nome]}'")
+        tipos_por_nome[nome] = tipo
+
+
+def _validar_estilo(tipo, estilo):
+    if not isinstance(estilo, dict) or not isinstance(estilo.get('nome'), str) or not estilo['nome'].strip():
+        raise ValueError(f"Estilo '{tipo}': informe o 'nome' do estilo")
+    for campo, valor in estilo.items():
+        if campo not in CAMPOS_ESTILO:
+            raise ValueError(f"Estilo '{tipo}': campo desconhecido '{campo}' "
+                             f"(aceitos: {', '.join(CAMPOS_ESTILO)})")
+        esperado = CAMPOS_ESTILO[campo]
+        # bool é subclasse de int: não aceitar true/false em campos numéricos
+        if not isinstance(valor, esperado) or (esperado is not bool and isinstance(valor, bool)):
+            raise ValueError(f"Estilo '{tipo}': valor inválido para '{campo}': {valor!r}")
+    if estilo.get('alinhamento', 'justify') not in ALINHAMENTOS_VALIDOS:
+        raise ValueError(f"Estilo '{tipo}': alinhamento deve ser um de {', '.join(ALINHAMENTOS_VALIDOS)}")
+    cor = estilo.get('cor_texto')
+    if cor is not None and (len(cor) != 3 or not all(isinstance(c, int) and not isinstance(c, bool) and 0 <= c <= 255
+                                                      for c in cor)):
+        raise ValueError(f"Estilo '{tipo}': 'cor_texto' deve ser uma lista [r, g, b] de 0 a 255")
+
+
+def compilar_regras(conteudo):
+    """Compila o conteúdo (bytes) de um arquivo de regras em um ConjuntoRegras."""
+    try:
+        dados = json.loads(conteudo)
+    except ValueError as e:
+        raise ValueError(f"Arquivo de regras inválido: {e}") from e
+    validar_regras(dados)
+    h = hashlib.sha256(conteudo)
+    h.update(f"classificador={ClassificadorParagrafos.VERSAO}".encode('ascii'))
+    try:
+        return ConjuntoRegras(dados, h.hexdigest())
+    except (re.error, TypeError) as e:
+        # Padrões válidos isoladamente podem falhar combinados na alternância
+        raise ValueError(f"Expressões regulares das regras inválidas em conjunto ({e})") from e
+
+
+REGRAS = ConjuntoRegras(dict(REGRAS_PADRAO, herdar_padrao=False), f"padrao-{ClassificadorParagrafos.VERSAO}")
+
+# Conjuntos já compilados por hash do conteúdo, do mais antigo ao mais recente uso,
+# e o hash de cada arquivo por (caminho, data de modificação, tamanho)
+_CONJUNTOS = OrderedDict()
+_HASHES_ARQUIVOS = {}
+_MAX_CONJUNTOS = 8
+_TRAVA = threading.Lock()
+
+
+def obter_regras(regras_path=None):
+    """
+    Retorna o ConjuntoRegras do arquivo, compilando-o só na primeira vez que
+    um conteúdo é visto; sem arquivo, retorna as regras padrão (REGRAS).
+    """
+    if regras_path is None:
+        return REGRAS
+    info = os.stat(regras_path)
+    chave_arquivo = (regras_path, info.st_mtime_ns, info.st_size)
+    with _TRAVA:
+        chave = _HASHES_ARQUIVOS.get(chave_arquivo)
+        conjunto = _CONJUNTOS.get(chave)
+        if conjunto is not None:
+            _CONJUNTOS.move_to_end(chave)
+            return conjunto
+
+    with open(regras_path, 'rb') as f:
+        conteudo = f.read()
+    chave = hashlib.sha256(conteudo).hexdigest()
+    with _TRAVA:
+        conjunto = _CONJUNTOS.get(chave)
+    if conjunto is None:
+        conjunto = compilar_regras(conteudo)
+
+    with _TRAVA:
+        if len(_HASHES_ARQUIVOS) >= 4 * _MAX_CONJUNTOS:
+            _HASHES_ARQUIVOS.clear()
+        _HASHES_ARQUIVOS[chave_arquivo] = chave
+        _CONJUNTOS[chave] = conjunto
+        _CONJUNTOS.move_to_end(chave)
+        if len(_CONJUNTOS) > _MAX_CONJUNTOS:
+            _CONJUNTOS.popitem(last=False)
+    return conjunto
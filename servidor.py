@@ -0,0 +1,328 @@
+"""
+API HTTP de formatação, para integração com outros sistemas sem o Streamlit.
+
+Rotas:
+    POST /formatar       Um documento: o corpo é o .docx (o nome pode vir em
+                         ?nome=...) ou um multipart/form-data com um arquivo.
+                         Responde com o .docx formatado.
+    POST /formatar/lote  Vários documentos em multipart/form-data. Responde com
+                         um ZIP transmitido à medida que os documentos ficam
+                         prontos (na ordem em que terminam); os erros, e os
+                         documentos que não terminaram no tempo máximo, vêm
+                         no membro erros.json.
+    GET  /saude          Estado da fila, em JSON.
+
+Nas rotas de formatação, ?preservar_runs=1 mantém a ênfase (negrito, itálico,
+sublinhado etc.) aplicada em trechos do texto original, e ?regras=nome usa o
+arquivo de regras nome.json do diretório --regras (ver regras.py).
+
+Exemplos:
+    python servidor.py --logo logo.png --porta 8502 --regras modelos/
+    curl --data-binary @peticao.docx "localhost:8502/formatar?nome=peticao.docx" -o formatado.docx
+    curl -F arquivo=@a.docx -F arquivo=@b.docx localhost:8502/formatar/lote -o formatados.zip
+"""
+import argparse
+import json
+import os
+import sys
+import traceback
+from email.parser import BytesParser
+from email.policy import HTTP
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+from cache import CacheResultados
+from fila import FilaTrabalhos
+from formatador import ArquivoZip
+from logo import preparar_logo_arquivo
+from regras import obter_regras
+
+# Configurações do servidor HTTP
+SERVIDOR_CONFIG = {
+    'host': '127.0.0.1',
+    'porta': 8502,
+    'tamanho_maximo': 50 * 1024 * 1024,  # Bytes aceitos por requisição
+    'max_arquivos': 200,  # Documentos por lote
+    'tempo_maximo': 300  # Segundos de espera pela formatação antes de desistir
+}
+
+MIME_DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+
+class ErroRequisicao(Exception):
+    """Requisição inválida; status é o código HTTP da resposta."""
+
+    def __init__(self, status, mensagem):
+        super().__init__(mensagem)
+        self.status = status
+
+
+def ler_multipart(content_type, corpo):
+    """Retorna a lista de tuplas (nome, dados) dos arquivos de um corpo multipart/form-data."""
+    mensagem = BytesParser(policy=HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + corpo
+    )
+    if not mensagem.is_multipart():
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "Corpo multipart inválido")
+    arquivos = []
+    for parte in mensagem.iter_parts():
+        nome = parte.get_filename()
+        if nome:
+            arquivos.append((os.path.basename(nome), parte.get_payload(decode=True) or b''))
+    return arquivos
+
+
+def ler_preservar_runs(parametros):
+    """Lê a opção preservar_runs dos parâmetros da URL."""
+    valor = parametros.get('preservar_runs', ['0'])[0].lower()
+    return valor in ('1', 'true', 'sim')
+
+
+def listar_regras(diretorio):
+    """Mapeia o nome de cada arquivo .json do diretório (sem a extensão) para seu caminho."""
+    return {os.path.splitext(nome)[0]: os.path.join(diretorio, nome)
+            for nome in sorted(os.listdir(diretorio)) if nome.endswith('.json')}
+
+
+class ManipuladorFormatacao(BaseHTTPRequestHandler):
+    """Atende às rotas da API; cada requisição roda na sua própria thread."""
+
+    server_version = 'FormatadorICA/1.0'
+
+    def do_GET(self):
+        if urlsplit(self.path).path != '/saude':
+            self._responder_erro(HTTPStatus.NOT_FOUND, "Rota não encontrada")
+            return
+        self._responder_json(HTTPStatus.OK, self.server.fila.estatisticas())
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        self._resposta_iniciada = False
+        try:
+            parametros = parse_qs(url.query)
+            if url.path == '/formatar':
+                self._formatar_um(parametros)
+            elif url.path == '/formatar/lote':
+                self._formatar_lote(parametros)
+            else:
+                raise ErroRequisicao(HTTPStatus.NOT_FOUND, "Rota não encontrada")
+        except ErroRequisicao as e:
+            self._responder_erro(e.status, str(e))
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # O cliente desistiu da resposta
+        except Exception:
+            self.log_error("Erro inesperado em %s", self.path)
+            traceback.print_exc(file=sys.stderr)
+            self.close_connection = True
+            if not self._resposta_iniciada:
+                self._responder_erro(HTTPStatus.INTERNAL_SERVER_ERROR, "Erro interno do servidor")
+
+    def _ler_corpo(self):
+        tamanho = self.headers.get('Content-Length')
+        if tamanho is None:
+            raise ErroRequisicao(HTTPStatus.LENGTH_REQUIRED, "Content-Length obrigatório")
+        try:
+            tamanho = int(tamanho)
+        except ValueError:
+            raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "Content-Length inválido")
+        if tamanho > self.server.tamanho_maximo:
+            # Sem ler o corpo; a conexão é encerrada depois da resposta
+            self.close_connection = True
+            raise ErroRequisicao(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                 f"Requisição maior que {self.server.tamanho_maximo} bytes")
+        return self.rfile.read(tamanho)
+
+    def _ler_arquivos(self):
+        corpo = self._ler_corpo()
+        content_type = self.headers.get('Content-Type', '')
+        if not content_type.startswith('multipart/form-data'):
+            raise ErroRequisicao(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, "Envie os arquivos em multipart/form-data")
+        arquivos = ler_multipart(content_type, corpo)
+        if not arquivos:
+            raise ErroRequisicao(HTTPStatus.BAD_REQUEST, "Nenhum arquivo enviado")
+        if len(arquivos) > self.server.max_arquivos:
+            raise ErroRequisicao(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                 f"No máximo {self.server.max_arquivos} arquivos por lote")
+        return arquivos
+
+    def _ler_regras(self, parametros):
+        """Caminho do arquivo de regras pedido em ?regras=nome, ou None para as regras padrão."""
+        nome = parametros.get('regras', [''])[0]
+        if not nome:
+            return None
+        if nome not in self.server.regras:
+            raise ErroRequisicao(HTTPStatus.BAD_REQUEST, f"Regras desconhecidas: {nome}")
+        return self.server.regras[nome]
+
+    def _executar(self, arquivos, preservar_runs=False, regras_path=None):
+        fila = self.server.fila
+        trabalho_id = fila.submeter(arquivos, self.server.logo_path, cache=self.server.cache,
+                                    preservar_runs=preservar_runs, regras_path=regras_path)
+        trabalho = fila.obter(trabalho_id)
+        try:
+            if not trabalho.aguardar(self.server.tempo_maximo):
+                raise ErroRequisicao(HTTPStatus.GATEWAY_TIMEOUT, "Tempo máximo de formatação excedido")
+            return trabalho
+        finally:
+            fila.remover(trabalho_id)
+
+    def _formatar_um(self, parametros):
+        if self.headers.get('Content-Type', '').startswith('multipart/form-data'):
+            arquivos = self._ler_arquivos()[:1]
+        else:
+            nome = os.path.basename(parametros.get('nome', ['documento.docx'])[0])
+            arquivos = [(nome, self._ler_corpo())]
+
+        trabalho = self._executar(arquivos, ler_preservar_runs(parametros), self._ler_regras(parametros))
+        if trabalho.erros:
+            raise ErroRequisicao(HTTPStatus.UNPROCESSABLE_ENTITY, trabalho.erros[0][1])
+        nome_saida, dados_saida = trabalho.resultados[0]
+        self._responder_arquivo(dados_saida, nome_saida, MIME_DOCX)
+
+    def _formatar_lote(self, parametros):
+        arquivos = self._ler_arquivos()
+        regras_path = self._ler_regras(parametros)
+        fila = self.server.fila
+        trabalho_id = fila.submeter(arquivos, self.server.logo_path, cache=self.server.cache, gerar_zip=False,
+                                    preservar_runs=ler_preservar_runs(parametros), regras_path=regras_path)
+        trabalho = fila.obter(trabalho_id)
+        try:
+            # O ZIP é transmitido enquanto os documentos ficam prontos, sem
+            # Content-Length; o fim da conexão marca o fim da resposta
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'application/zip')
+            self.send_header('Content-Disposition', "attachment; filename=Documentos_Formatados_ICA.zip")
+            self.end_headers()
+            self._resposta_iniciada = True
+            self.close_connection = True
+
+            zip_arquivo = ArquivoZip(self.wfile)
+            entregues = set()
+            erros = []
+            try:
+                for i in trabalho.acompanhar(self.server.tempo_maximo):
+                    entregues.add(i)
+                    if trabalho.resultados[i] is not None:
+                        zip_arquivo.adicionar(*trabalho.resultados[i])
+                erros = list(trabalho.erros)
+            except TimeoutError as e:
+                # Os cabeçalhos já foram enviados: os documentos que não
+                # terminaram a tempo vão para erros.json e o ZIP é fechado
+                erros = list(trabalho.erros)
+                com_erro = {nome for nome, _ in erros}
+                erros += [(nome, str(e)) for i, nome in enumerate(trabalho.nomes)
+                          if i not in entregues and nome not in com_erro]
+            if erros:
+                erros = [{'arquivo': n, 'erro': e} for n, e in erros]
+                zip_arquivo.adicionar('erros.json', json.dumps(erros, ensure_ascii=False, indent=2).encode('utf-8'))
+            zip_arquivo.fechar()
+        finally:
+            fila.remover(trabalho_id)
+
+    def _responder_arquivo(self, dados, nome, content_type):
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(dados)))
+        self.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{quote(nome)}")
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _responder_json(self, status, conteudo):
+        dados = json.dumps(conteudo).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _responder_erro(self, status, mensagem):
+        self._responder_json(status, {'erro': mensagem})
+
+
+class ServidorFormatacao(ThreadingHTTPServer):
+    """Servidor HTTP com a fila de formatação e os limites compartilhados pelas requisições."""
+
+    daemon_threads = True
+
+    def __init__(self, endereco, fila, logo_path=None, cache=None, tamanho_maximo=None,
+                 max_arquivos=None, tempo_maximo=None, regras=None):
+        super().__init__(endereco, ManipuladorFormatacao)
+        self.fila = fila
+        self.logo_path = logo_path
+        self.regras = regras or {}
+        self.cache = cache
+        self.tamanho_maximo = tamanho_maximo or SERVIDOR_CONFIG['tamanho_maximo']
+        self.max_arquivos = max_arquivos or SERVIDOR_CONFIG['max_arquivos']
+        self.tempo_maximo = tempo_maximo or SERVIDOR_CONFIG['tempo_maximo']
+
+
+def criar_parser():
+    parser = argparse.ArgumentParser(
+        description="API HTTP para formatar documentos jurídicos (.docx) no padrão ICA Advocacia."
+    )
+    parser.add_argument('--host', default=SERVIDOR_CONFIG['host'],
+                        help="Endereço de escuta (padrão: %(default)s)")
+    parser.add_argument('--porta', type=int, default=SERVIDOR_CONFIG['porta'],
+                        help="Porta de escuta (padrão: %(default)s)")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="Número de processos de formatação (padrão: limite global da fila)")
+    parser.add_argument('--logo', default=None,
+                        help="Imagem do logo para o cabeçalho, carregada uma vez na inicialização")
+    parser.add_argument('--tamanho-maximo', type=int, default=SERVIDOR_CONFIG['tamanho_maximo'] // (1024 * 1024),
+                        help="Tamanho máximo de cada requisição, em MB (padrão: %(default)s)")
+    parser.add_argument('--cache', action='store_true',
+                        help="Reaproveita documentos já formatados (ver cache.CACHE_CONFIG)")
+    parser.add_argument('--regras', default=None,
+                        help="Diretório com arquivos de regras (nome.json), escolhidos por ?regras=nome")
+    return parser
+
+
+def main(argv=None):
+    args = criar_parser().parse_args(argv)
+
+    if args.logo and not os.path.exists(args.logo):
+        print(f"Logo não encontrado: {args.logo}", file=sys.stderr)
+        return 2
+    if args.logo:
+        # Reduzido uma vez ao tamanho de impressão, em vez de embutido no original em cada documento
+        try:
+            args.logo = preparar_logo_arquivo(args.logo)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+
+    regras = {}
+    if args.regras:
+        # Validados na inicialização; cada processo compila cada arquivo uma única vez
+        try:
+            # Os nomes dos estilos são conferidos contra o documento base do python-docx
+            from documento import verificar_estilos
+            regras = listar_regras(args.regras)
+            for caminho in regras.values():
+                verificar_estilos(obter_regras(caminho))
+        except (OSError, ValueError) as e:
+            print(f"Regras inválidas: {e}", file=sys.stderr)
+            return 2
+
+    fila = FilaTrabalhos(limite=args.workers, logo_path=args.logo)
+    fila.aquecer()
+    servidor = ServidorFormatacao(
+        (args.host, args.porta), fila, args.logo,
+        cache=CacheResultados() if args.cache else None,
+        tamanho_maximo=args.tamanho_maximo * 1024 * 1024,
+        regras=regras,
+    )
+    print(f"Servindo em http://{args.host}:{args.porta} com {fila.limite} processo(s)", file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        fila.encerrar()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())